@@ -0,0 +1,324 @@
+"""Пакетная конвертация видео в кружочки из командной строки.
+
+Принимает файлы, папки, glob-шаблоны и ссылки (в аргументах или списком из
+файла), обрабатывает их параллельно и складывает кружочки в выходную папку
+вместе с манифестом manifest.json. Повторный запуск пропускает то, что уже
+обработано с теми же настройками.
+
+Примеры:
+    python batch.py videos/*.mp4 -o circles_out
+    python batch.py "raw/**/*.mov" --urls links.txt --workers 4 --segment-duration 15
+
+Не импортирует telegram и не требует BOT_TOKEN.
+"""
+
+import argparse
+import asyncio
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import config
+import encoding_profiles
+from video_processor import check_ffmpeg_available, cut_video_to_circles, download_video, extract_video_info
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+VIDEO_EXTENSIONS = ['.mp4', '.webm', '.mov', '.avi', '.mkv', '.flv', '.wmv', '.m4v']
+
+
+def is_url(value: str) -> bool:
+    return value.startswith('http://') or value.startswith('https://')
+
+
+def expand_inputs(items: List[str], url_list: Optional[str] = None) -> List[str]:
+    """
+    Разворачивает аргументы в список входов: ссылки, файлы, папки и glob-шаблоны.
+
+    Args:
+        items: Аргументы командной строки
+        url_list: Файл со списком ссылок (по одной на строку, # - комментарий)
+
+    Returns:
+        Список ссылок и путей к файлам без повторов, в исходном порядке
+    """
+    inputs = []
+    for item in items:
+        if is_url(item):
+            inputs.append(item)
+        elif os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                inputs.extend(
+                    os.path.join(root, name) for name in sorted(files)
+                    if os.path.splitext(name)[1].lower() in VIDEO_EXTENSIONS
+                )
+        elif os.path.isfile(item):
+            inputs.append(item)
+        else:
+            matches = sorted(path for path in glob.glob(item, recursive=True) if os.path.isfile(path))
+            if not matches:
+                logger.warning(f"Ничего не найдено по {item}")
+            inputs.extend(matches)
+
+    if url_list:
+        with open(url_list, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    inputs.append(line)
+
+    return list(dict.fromkeys(inputs))
+
+
+def default_profile_name() -> str:
+    """
+    Профиль по умолчанию: самый качественный из ENCODING_PROFILES, а при
+    выключенном ADAPTIVE_ENCODING - "static" (FFMPEG_PRESET, FFMPEG_CRF, VIDEO_SIZE).
+    """
+    if config.ADAPTIVE_ENCODING and config.ENCODING_PROFILES:
+        return config.ENCODING_PROFILES[0]["name"]
+    return "static"
+
+
+def resolve_profile(name: str) -> Optional[Dict]:
+    """
+    Профиль по имени из config.ENCODING_PROFILES; "static" - статические настройки
+    из config, None для "adaptive" (выбор по нагрузке).
+    """
+    if name == "adaptive":
+        return None
+    if name == "static":
+        return encoding_profiles.static_profile()
+    for profile in config.ENCODING_PROFILES:
+        if profile["name"] == name:
+            return {key: profile[key] for key in ("name", "preset", "crf", "size")}
+    raise ValueError(f"Неизвестный профиль кодирования: {name}")
+
+
+def current_settings(segment_duration: int, profile_name: Optional[str] = None) -> Dict:
+    """
+    Настройки, влияющие на результат; входят в ключ повторного использования.
+
+    Пресет и CRF записываются только в profile_settings - в том виде, в каком
+    они реально используются (профиль, статические настройки или все профили).
+    """
+    profile_name = profile_name or default_profile_name()
+    if profile_name != "adaptive":
+        profile_settings = resolve_profile(profile_name)
+    elif config.ADAPTIVE_ENCODING and config.ENCODING_PROFILES:
+        profile_settings = config.ENCODING_PROFILES
+    else:
+        profile_settings = encoding_profiles.static_profile()
+    return {
+        "segment_duration": segment_duration,
+        "smart_boundaries": config.SMART_SEGMENT_BOUNDARIES,
+        "profile": profile_name,
+        "profile_settings": profile_settings,
+        "video_size": config.VIDEO_SIZE,
+        "crop_mode": config.VIDEO_CROP_MODE,
+        "video_codec": config.FFMPEG_VIDEO_CODEC,
+        "audio_codec": config.FFMPEG_AUDIO_CODEC,
+        "audio_bitrate": config.FFMPEG_AUDIO_BITRATE,
+        "max_file_size": config.MAX_FILE_SIZE,
+    }
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 содержимого файла (читается блоками)."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def job_key(content_hash: str, settings: Dict) -> str:
+    """Ключ задания: хеш содержимого плюс хеш настроек."""
+    settings_hash = hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+    return hashlib.sha256(f"{content_hash}:{settings_hash}".encode()).hexdigest()
+
+
+class Manifest:
+    """Манифест выходной папки: какие входы во что превратились."""
+
+    def __init__(self, output_dir: Path):
+        self.path = output_dir / MANIFEST_NAME
+        self.output_dir = output_dir
+        self.entries: Dict[str, Dict] = {}
+        if self.path.exists():
+            with open(self.path, encoding='utf-8') as f:
+                self.entries = json.load(f).get("entries", {})
+
+    def is_done(self, key: str) -> bool:
+        entry = self.entries.get(key)
+        return bool(entry) and all((self.output_dir / name).exists() for name in entry["outputs"])
+
+    def find_url(self, url: str, settings: Dict) -> Optional[str]:
+        """Ключ уже обработанной ссылки с теми же настройками (без повторного скачивания)."""
+        for key, entry in self.entries.items():
+            if entry.get("url") == url and entry.get("settings") == settings and self.is_done(key):
+                return key
+        return None
+
+    def find_video(self, video_id: str, settings: Dict) -> Optional[str]:
+        """Ключ уже обработанного видео с тем же id (ссылка могла быть записана иначе)."""
+        for key, entry in self.entries.items():
+            if entry.get("video_id") == video_id and entry.get("settings") == settings and self.is_done(key):
+                return key
+        return None
+
+    def add(self, key: str, entry: Dict) -> None:
+        self.entries[key] = entry
+        self.save()
+
+    def save(self) -> None:
+        tmp_path = self.path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"entries": self.entries}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+async def process_input(source: str, output_dir: Path, manifest: Manifest, settings: Dict,
+                        force: bool) -> Dict:
+    """
+    Обрабатывает один вход: скачивает (если это ссылка), нарезает и переименовывает результаты.
+
+    Returns:
+        Словарь с результатом: {"input", "status", "outputs"|"error"}
+    """
+    started = time.perf_counter()
+    work_dir = output_dir / ".work" / hashlib.sha256(source.encode()).hexdigest()[:16]
+
+    try:
+        if is_url(source):
+            key = None if force else manifest.find_url(source, settings)
+            if key:
+                return {"input": source, "status": "skipped", "outputs": manifest.entries[key]["outputs"]}
+            # Метаданные извлекаются без скачивания и потом переиспользуются download_video
+            video_id = (await extract_video_info(source))["id"]
+            key = None if force or not video_id else manifest.find_video(video_id, settings)
+            if key:
+                return {"input": source, "status": "skipped", "outputs": manifest.entries[key]["outputs"]}
+            work_dir.mkdir(parents=True, exist_ok=True)
+            video_path = await download_video(source, str(work_dir))
+            stem = "url"
+        else:
+            video_id = None
+            video_path = source
+            stem = Path(source).stem
+
+        content_hash = await asyncio.to_thread(file_sha256, video_path)
+        key = job_key(content_hash, settings)
+        if not force and manifest.is_done(key):
+            return {"input": source, "status": "skipped", "outputs": manifest.entries[key]["outputs"]}
+
+        work_dir.mkdir(parents=True, exist_ok=True)
+        segments = await cut_video_to_circles(video_path, settings["segment_duration"], str(work_dir), key[:12],
+                                              profile=resolve_profile(settings["profile"]))
+
+        base = f"{stem}_{key[:12]}"
+        outputs = []
+        for i, segment_path in enumerate(segments):
+            name = f"{base}_{i:03d}.mp4"
+            os.replace(segment_path, output_dir / name)
+            outputs.append(name)
+
+        job = encoding_profiles.current_job() or {}
+        manifest.add(key, {
+            "input": os.path.abspath(source) if not is_url(source) else None,
+            "url": source if is_url(source) else None,
+            "video_id": video_id,
+            "sha256": content_hash,
+            "settings": settings,
+            "profile": job.get("profile"),
+            "outputs": outputs,
+            "sizes": [os.path.getsize(output_dir / name) for name in outputs],
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "elapsed": round(time.perf_counter() - started, 3),
+        })
+        return {"input": source, "status": "done", "outputs": outputs}
+    except Exception as e:
+        logger.error(f"Ошибка обработки {source}: {e}")
+        return {"input": source, "status": "failed", "error": str(e)}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+async def run_batch(inputs: List[str], output_dir: Path, workers: int, segment_duration: int,
+                    force: bool, profile_name: Optional[str] = None) -> List[Dict]:
+    """
+    Обрабатывает входы параллельно, не более workers одновременно.
+
+    В нагрузке учитываются только выполняющиеся задания: очередь пачки
+    не должна переводить адаптивный режим на самые быстрые профили.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest = Manifest(output_dir)
+    settings = current_settings(segment_duration, profile_name)
+    semaphore = asyncio.Semaphore(workers)
+
+    async def worker(source: str) -> Dict:
+        async with semaphore:
+            with encoding_profiles.track_job(source=source):
+                result = await process_input(source, output_dir, manifest, settings, force)
+                logger.info(f"[{result['status']}] {source}")
+                return result
+
+    results = await asyncio.gather(*(worker(source) for source in inputs))
+    try:
+        (output_dir / ".work").rmdir()
+    except OSError:
+        pass
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Пакетная нарезка видео на кружочки")
+    parser.add_argument("inputs", nargs="*", help="Файлы, папки, glob-шаблоны или ссылки")
+    parser.add_argument("--urls", help="Файл со списком ссылок (по одной на строку)")
+    parser.add_argument("-o", "--output-dir", default="circles_out", help="Папка для результатов")
+    parser.add_argument("-w", "--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="Количество параллельных заданий")
+    parser.add_argument("-s", "--segment-duration", type=int, default=config.DEFAULT_SEGMENT_DURATION,
+                        help="Длительность отрезка в секундах")
+    parser.add_argument("--profile", default=default_profile_name(),
+                        choices=["adaptive", "static"] + [p["name"] for p in config.ENCODING_PROFILES],
+                        help="Профиль кодирования (по умолчанию самый качественный, а без ADAPTIVE_ENCODING - "
+                             "static из config; adaptive - по нагрузке, тогда качество результата "
+                             "зависит от загрузки машины)")
+    parser.add_argument("--force", action="store_true", help="Обработать заново, даже если уже готово")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Подробный лог")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO if args.verbose else logging.WARNING
+    )
+    logger.setLevel(logging.INFO)
+
+    inputs = expand_inputs(args.inputs, args.urls)
+    if not inputs:
+        parser.error("не указано ни одного входа")
+    if not check_ffmpeg_available():
+        print("FFmpeg недоступен: обработка невозможна", file=sys.stderr)
+        sys.exit(2)
+
+    segment_duration = max(config.MIN_SEGMENT_DURATION, min(config.MAX_SEGMENT_DURATION, args.segment_duration))
+    results = asyncio.run(run_batch(inputs, Path(args.output_dir), max(1, args.workers), segment_duration,
+                                    args.force, args.profile))
+
+    counts = {status: sum(1 for r in results if r["status"] == status) for status in ("done", "skipped", "failed")}
+    print(f"Готово: {counts['done']}, пропущено: {counts['skipped']}, ошибок: {counts['failed']}")
+    sys.exit(1 if counts["failed"] else 0)
+
+
+if __name__ == '__main__':
+    main()
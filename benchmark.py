@@ -0,0 +1,344 @@
+"""Воспроизводимый бенчмарк конвейера обработки видео.
+
+Генерирует синтетические исходники через lavfi-источники FFmpeg (без сети),
+прогоняет на них get_video_duration, cut_video_to_circles, optimize_video_size
+и analyze_segment_boundaries и сохраняет результаты в JSON для сравнения с эталоном.
+
+Примеры:
+    python benchmark.py                          # полный набор конфигураций
+    python benchmark.py --quick                  # быстрый прогон
+    python benchmark.py -o new.json --baseline base.json --tolerance 0.15
+
+Каждая пара (конфигурация, операция) выполняется в отдельном процессе, чтобы
+CPU-время и пиковая память дочерних процессов ffmpeg считались изолированно.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    import resource  # Недоступен в Windows
+except ImportError:
+    resource = None
+
+import config
+
+BENCH_DIR = Path(config.TEMP_VIDEOS_DIR) / "bench"
+
+# Синтетические исходники: длительность (с), разрешение, частота кадров, битрейт
+BENCH_CONFIGS = [
+    {"name": "square_360p_short", "duration": 6, "width": 360, "height": 360, "fps": 30, "bitrate": "1M"},
+    {"name": "landscape_720p", "duration": 20, "width": 1280, "height": 720, "fps": 30, "bitrate": "4M"},
+    {"name": "portrait_1080p", "duration": 20, "width": 1080, "height": 1920, "fps": 30, "bitrate": "8M"},
+    {"name": "sd_4x3_long", "duration": 60, "width": 640, "height": 480, "fps": 25, "bitrate": "1500k"},
+    {"name": "landscape_720p_60fps", "duration": 15, "width": 1280, "height": 720, "fps": 60, "bitrate": "6M"},
+    {"name": "fullhd_high_bitrate", "duration": 12, "width": 1920, "height": 1080, "fps": 30, "bitrate": "25M"},
+]
+
+QUICK_CONFIGS = ["square_360p_short", "landscape_720p"]
+
+OPERATIONS = ["get_video_duration", "cut_video_to_circles", "optimize_video_size", "analyze_segment_boundaries"]
+
+# Метрики, по которым сравниваем с эталоном (больше = хуже)
+COMPARED_METRICS = ["wall_time", "cpu_time", "peak_memory_kb"]
+
+
+def source_path(cfg: Dict) -> Path:
+    """Путь к синтетическому исходнику для конфигурации."""
+    return BENCH_DIR / f"src_{cfg['name']}.mp4"
+
+
+def generate_source(cfg: Dict) -> Path:
+    """
+    Генерирует синтетическое видео через lavfi (testsrc2 + синус для звука).
+
+    Уже сгенерированные файлы переиспользуются: параметры зашиты в имени
+    конфигурации, поэтому при изменении набора нужно менять и имя.
+    """
+    path = source_path(cfg)
+    if path.exists():
+        return path
+
+    BENCH_DIR.mkdir(parents=True, exist_ok=True)
+    from video_processor import get_ffmpeg_command
+
+    duration = cfg["duration"]
+    cmd = [
+        get_ffmpeg_command('ffmpeg'), '-v', 'error',
+        '-f', 'lavfi', '-i',
+        f"testsrc2=size={cfg['width']}x{cfg['height']}:rate={cfg['fps']}:duration={duration}",
+        '-f', 'lavfi', '-i', f"sine=frequency=440:sample_rate=44100:duration={duration}",
+        '-c:v', 'libx264', '-preset', 'veryfast',
+        '-b:v', cfg["bitrate"], '-maxrate', cfg["bitrate"], '-bufsize', cfg["bitrate"],
+        '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-b:a', '128k',
+        '-shortest', '-movflags', '+faststart',
+        '-y', str(path)
+    ]
+    result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(
+            f"Не удалось сгенерировать исходник {cfg['name']}: "
+            f"{result.stderr.decode('utf-8', errors='ignore')}"
+        )
+    return path
+
+
+def _rusage() -> Dict[str, float]:
+    """Снимок CPU-времени и пиковой памяти процесса и его дочерних процессов."""
+    if resource is None:
+        return {"cpu_time": time.process_time(), "peak_memory_kb": None}
+
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    peak = max(own.ru_maxrss, children.ru_maxrss)
+    if sys.platform == "darwin":
+        peak //= 1024  # В macOS ru_maxrss в байтах
+    return {
+        "cpu_time": own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime,
+        "peak_memory_kb": peak,
+    }
+
+
+def bench_profile() -> Dict:
+    """
+    Профиль кодирования для замеров: всегда статический (FFMPEG_PRESET, FFMPEG_CRF,
+    VIDEO_SIZE), иначе адаптивный выбор зависел бы от загрузки, которую создаёт сам бенчмарк.
+    """
+    import encoding_profiles
+    return encoding_profiles.static_profile()
+
+
+async def _run_operation(operation: str, cfg: Dict) -> Dict:
+    """Выполняет одну операцию над исходником и возвращает её результаты."""
+    import encoding_profiles
+    import video_processor
+
+    src = source_path(cfg)
+    result: Dict = {"input_size": os.path.getsize(src)}
+
+    if operation == "get_video_duration":
+        result["duration"] = await video_processor.get_video_duration(str(src))
+        result["output_sizes"] = []
+
+    elif operation == "cut_video_to_circles":
+        with encoding_profiles.track_job() as job:
+            files = await video_processor.cut_video_to_circles(str(src), config.DEFAULT_SEGMENT_DURATION,
+                                                               profile=bench_profile())
+        # Фактический профиль (с учётом разрешения исходника) и сколько отрезков скопировано без перекодирования
+        result["profile"] = job.get("profile")
+        result["copied_segments"] = job.get("copied_segments", 0)
+        result["output_sizes"] = [os.path.getsize(path) for path in files]
+        for path in files:
+            os.remove(path)
+
+    elif operation == "analyze_segment_boundaries":
+        # Стоимость прохода анализа для SMART_SEGMENT_BOUNDARIES (без кеша)
+        analysis = await video_processor.analyze_segment_boundaries(str(src), use_cache=False)
+        result["scenes"] = len(analysis["scenes"])
+        result["silences"] = len(analysis["silences"])
+        result["output_sizes"] = []
+
+    elif operation == "optimize_video_size":
+        # optimize_video_size удаляет исходный файл, поэтому работаем с копией
+        work_copy = BENCH_DIR / f"work_{cfg['name']}.mp4"
+        shutil.copyfile(src, work_copy)
+        result["profile"] = bench_profile()
+        optimized = await video_processor.optimize_video_size(str(work_copy), profile=bench_profile())
+        result["output_sizes"] = [os.path.getsize(optimized)]
+        for path in {str(work_copy), optimized}:
+            if os.path.exists(path):
+                os.remove(path)
+
+    else:
+        raise ValueError(f"Неизвестная операция: {operation}")
+
+    result["oversized_segments"] = sum(1 for size in result["output_sizes"] if size > config.MAX_FILE_SIZE)
+    result["total_output_size"] = sum(result["output_sizes"])
+    return result
+
+
+def run_worker(operation: str, config_name: str) -> None:
+    """Точка входа дочернего процесса: замеряет одну операцию и печатает JSON."""
+    cfg = next(c for c in BENCH_CONFIGS if c["name"] == config_name)
+
+    before = _rusage()
+    started = time.perf_counter()
+    result = asyncio.run(_run_operation(operation, cfg))
+    wall_time = time.perf_counter() - started
+    after = _rusage()
+
+    result.update({
+        "wall_time": wall_time,
+        "cpu_time": after["cpu_time"] - before["cpu_time"],
+        "peak_memory_kb": after["peak_memory_kb"],
+    })
+    print(json.dumps(result))
+
+
+def measure(operation: str, cfg: Dict) -> Dict:
+    """Запускает замер в отдельном процессе и возвращает разобранный результат."""
+    cmd = [sys.executable, os.path.abspath(__file__), "--worker", operation, cfg["name"]]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "неизвестная ошибка"}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def ffmpeg_version() -> Optional[str]:
+    """Первая строка `ffmpeg -version` (для сопоставимости результатов)."""
+    from video_processor import get_ffmpeg_command
+    try:
+        result = subprocess.run([get_ffmpeg_command('ffmpeg'), '-version'], capture_output=True, text=True, timeout=5)
+        return result.stdout.splitlines()[0] if result.stdout else None
+    except Exception:
+        return None
+
+
+def run_suite(configs: List[Dict], operations: List[str], repeat: int) -> Dict:
+    """Прогоняет все операции на всех конфигурациях, выбирая лучший из повторов."""
+    results = []
+    for cfg in configs:
+        print(f"[{cfg['name']}] генерация исходника...", file=sys.stderr)
+        generate_source(cfg)
+        for operation in operations:
+            runs = [measure(operation, cfg) for _ in range(repeat)]
+            ok_runs = [run for run in runs if "error" not in run]
+            if ok_runs:
+                # Берём самый быстрый прогон: он меньше всего зашумлён
+                best = min(ok_runs, key=lambda run: run["wall_time"])
+                best["runs"] = len(ok_runs)
+            else:
+                best = runs[-1]
+            best.update({"config": cfg["name"], "operation": operation})
+            results.append(best)
+            if "error" in best:
+                print(f"  {operation}: ОШИБКА {best['error']}", file=sys.stderr)
+            else:
+                print(
+                    f"  {operation}: {best['wall_time']:.2f} с, CPU {best['cpu_time']:.2f} с, "
+                    f"превышений лимита {best['oversized_segments']}",
+                    file=sys.stderr,
+                )
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "ffmpeg": ffmpeg_version(),
+            "settings": {
+                "VIDEO_SIZE": config.VIDEO_SIZE,
+                "DEFAULT_SEGMENT_DURATION": config.DEFAULT_SEGMENT_DURATION,
+                "MAX_FILE_SIZE": config.MAX_FILE_SIZE,
+                "profile": bench_profile(),
+                "VIDEO_CROP_MODE": config.VIDEO_CROP_MODE,
+            },
+        },
+        "configs": configs,
+        "results": results,
+    }
+
+
+def compare_with_baseline(current: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Сравнивает результаты с эталоном.
+
+    Returns:
+        Список описаний регрессий (пустой, если регрессий нет)
+    """
+    base_index = {(r["config"], r["operation"]): r for r in baseline.get("results", [])}
+    regressions = []
+
+    for result in current["results"]:
+        key = (result["config"], result["operation"])
+        base = base_index.get(key)
+        if base is None or "error" in base:
+            continue
+        if "error" in result:
+            regressions.append(f"{key[0]}/{key[1]}: ошибка ({result['error']})")
+            continue
+        if base.get("profile") != result.get("profile"):
+            print(f"Предупреждение: {key[0]}/{key[1]} - профиль кодирования отличается от эталона, "
+                  f"результаты несопоставимы", file=sys.stderr)
+
+        for metric in COMPARED_METRICS:
+            old, new = base.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            result.setdefault("delta", {})[metric] = round(change, 4)
+            if change > tolerance:
+                regressions.append(f"{key[0]}/{key[1]}: {metric} {old:.3f} -> {new:.3f} (+{change:.0%})")
+
+        if result["oversized_segments"] > base.get("oversized_segments", 0):
+            regressions.append(
+                f"{key[0]}/{key[1]}: превышений MAX_FILE_SIZE "
+                f"{base.get('oversized_segments', 0)} -> {result['oversized_segments']}"
+            )
+
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк конвейера нарезки видео на кружочки")
+    parser.add_argument("-o", "--output", default="bench_results.json", help="Куда сохранить результаты (JSON)")
+    parser.add_argument("--baseline", help="JSON с эталонными результатами для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Допустимое ухудшение метрик (доля)")
+    parser.add_argument("--quick", action="store_true", help="Только быстрые конфигурации")
+    parser.add_argument("--config", action="append", help="Запустить только указанные конфигурации")
+    parser.add_argument("--operation", action="append", choices=OPERATIONS, help="Запустить только указанные операции")
+    parser.add_argument("--repeat", type=int, default=1, help="Количество повторов каждого замера")
+    parser.add_argument("--worker", nargs=2, metavar=("OPERATION", "CONFIG"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(*args.worker)
+        return
+
+    configs = BENCH_CONFIGS
+    if args.quick:
+        configs = [c for c in configs if c["name"] in QUICK_CONFIGS]
+    if args.config:
+        configs = [c for c in configs if c["name"] in args.config]
+    operations = args.operation or OPERATIONS
+
+    from video_processor import check_ffmpeg_available
+    if not check_ffmpeg_available():
+        print("FFmpeg недоступен: бенчмарк невозможен", file=sys.stderr)
+        sys.exit(2)
+
+    report = run_suite(configs, operations, max(1, args.repeat))
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(report, baseline, args.tolerance)
+        report["regressions"] = regressions
+        if regressions:
+            print("\nРегрессии относительно эталона:", file=sys.stderr)
+            for line in regressions:
+                print(f"  - {line}", file=sys.stderr)
+            exit_code = 1
+        else:
+            print("\nРегрессий относительно эталона нет", file=sys.stderr)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {args.output}", file=sys.stderr)
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,25 @@
 """Telegram бот для нарезки видео на кружочки"""
 
+from __future__ import annotations
+
+import asyncio
 import os
 import logging
 from pathlib import Path
-from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from dotenv import load_dotenv
-from video_processor import process_video_to_circles, cut_video_to_circles, check_ffmpeg_available
+from typing import TYPE_CHECKING, Optional, Union
+from video_processor import (
+    process_video_to_circles, cut_video_to_circles, check_ffmpeg_available, extract_video_info
+)
 import config
+import encoding_profiles
+import quotas
+import segment_buffers
 
-# Загрузка переменных окружения
-load_dotenv()
-BOT_TOKEN = os.getenv('BOT_TOKEN')
-
-if not BOT_TOKEN:
-    raise ValueError("BOT_TOKEN не найден в переменных окружения. Создайте файл .env с BOT_TOKEN=your_token")
+# telegram импортируется лениво (в build_application/main), чтобы импорт модуля
+# и запуск рабочих процессов не тратили время на загрузку библиотеки
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import Application, ContextTypes
 
 # Настройка логирования
 logging.basicConfig(
@@ -24,6 +29,30 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+class UpdateQueue(asyncio.Queue):
+    """
+    Очередь обновлений для Application, которая считает ещё не обработанные обновления.
+    
+    PTB вызывает task_done() только после обработки обновления, поэтому pending -
+    это и ждущие в очереди, и обрабатываемые сейчас. Задания, которые ждут своей
+    очереди, ещё не вошли в track_job; без этого счётчика адаптивные профили
+    видели бы в последовательном режиме не больше одного задания.
+    """
+    
+    def __init__(self) -> None:
+        super().__init__()
+        self.pending = 0
+    
+    def put_nowait(self, item) -> None:
+        # put() тоже вызывает put_nowait()
+        super().put_nowait(item)
+        self.pending += 1
+    
+    def task_done(self) -> None:
+        super().task_done()
+        self.pending -= 1
+
+
 def get_message_type(message) -> str:
     """
     Определяет тип сообщения через проверку атрибутов.
@@ -127,119 +156,138 @@ async def handle_video_file(update: Update, context: ContextTypes.DEFAULT_TYPE)
             )
             return
     
-    # Отправляем сообщение о начале обработки
-    status_message = await update.message.reply_text("⏳ Скачиваю и обрабатываю видео...")
-    
-    video_files = []
-    temp_video_path = None
-    
+    # Проверяем ограничения до скачивания
     try:
-        # Скачиваем видео файл из Telegram
-        file = await context.bot.get_file(video.file_id)
-        
-        # Определяем расширение файла
-        file_ext = '.mp4'
-        if hasattr(video, 'mime_type') and video.mime_type:
-            if 'webm' in video.mime_type:
-                file_ext = '.webm'
-            elif 'quicktime' in video.mime_type or 'mov' in video.mime_type:
-                file_ext = '.mov'
-        
-        # Если это документ, пробуем определить расширение по имени файла
-        if hasattr(video, 'file_name') and video.file_name:
-            file_name_lower = video.file_name.lower()
-            if file_name_lower.endswith('.webm'):
-                file_ext = '.webm'
-            elif file_name_lower.endswith('.mov'):
-                file_ext = '.mov'
-            elif file_name_lower.endswith('.avi'):
-                file_ext = '.avi'
-            elif file_name_lower.endswith('.mkv'):
-                file_ext = '.mkv'
-            elif file_name_lower.endswith('.mp4'):
-                file_ext = '.mp4'
-        
-        temp_video_path = Path(config.TEMP_VIDEOS_DIR) / f"telegram_video_{chat_id}_{video.file_id}{file_ext}"
-        temp_video_path.parent.mkdir(exist_ok=True)
-        
-        await file.download_to_drive(custom_path=str(temp_video_path))
-        logger.info(f"Видео скачано: {temp_video_path}")
-        
-        # Обрабатываем видео
-        video_files = await cut_video_to_circles(str(temp_video_path), config.DEFAULT_SEGMENT_DURATION)
+        reservation = quotas.check_request(chat_id, duration=getattr(video, 'duration', None),
+                                           download_bytes=file_size)
+    except quotas.QuotaExceeded as e:
+        logger.info(f"Запрос пользователя {chat_id} отклонён: {e}")
+        await update.message.reply_text(f"❌ {e}")
+        return
+    
+    # Регистрируем задание: по числу активных заданий выбирается профиль кодирования,
+    # а по завершении израсходованные ресурсы списываются с квоты пользователя
+    with encoding_profiles.track_job(chat_id=chat_id, kind="file", reservation=reservation) as job, \
+            quotas.account_job(chat_id, job):
+        # Отправляем сообщение о начале обработки
+        status_message = await update.message.reply_text("⏳ Скачиваю и обрабатываю видео...")
         
-        if not video_files:
-            await status_message.edit_text("❌ Не удалось обработать видео. Проверь ссылку.")
-            return
+        video_files = []
+        temp_video_path = None
         
-        # Отправляем каждый кружочек
-        total = len(video_files)
-        for i, video_path in enumerate(video_files, 1):
-            try:
-                with open(video_path, 'rb') as video_file:
-                    await update.message.reply_video_note(
-                        video_note=video_file,
-                        duration=None  # Telegram сам определит длительность
-                    )
-                
-                # Удаляем временный файл после успешной отправки
+        try:
+            # Скачиваем видео файл из Telegram
+            file = await context.bot.get_file(video.file_id)
+            
+            # Определяем расширение файла
+            file_ext = '.mp4'
+            if hasattr(video, 'mime_type') and video.mime_type:
+                if 'webm' in video.mime_type:
+                    file_ext = '.webm'
+                elif 'quicktime' in video.mime_type or 'mov' in video.mime_type:
+                    file_ext = '.mov'
+            
+            # Если это документ, пробуем определить расширение по имени файла
+            if hasattr(video, 'file_name') and video.file_name:
+                file_name_lower = video.file_name.lower()
+                if file_name_lower.endswith('.webm'):
+                    file_ext = '.webm'
+                elif file_name_lower.endswith('.mov'):
+                    file_ext = '.mov'
+                elif file_name_lower.endswith('.avi'):
+                    file_ext = '.avi'
+                elif file_name_lower.endswith('.mkv'):
+                    file_ext = '.mkv'
+                elif file_name_lower.endswith('.mp4'):
+                    file_ext = '.mp4'
+            
+            temp_video_path = Path(config.TEMP_VIDEOS_DIR) / f"telegram_video_{chat_id}_{video.file_id}{file_ext}"
+            temp_video_path.parent.mkdir(exist_ok=True)
+            
+            await file.download_to_drive(custom_path=str(temp_video_path))
+            job["download_bytes"] = os.path.getsize(temp_video_path)
+            logger.info(f"Видео скачано: {temp_video_path}")
+            
+            # Обрабатываем видео
+            video_files = await cut_video_to_circles(str(temp_video_path), config.DEFAULT_SEGMENT_DURATION)
+            
+            if not video_files:
+                await status_message.edit_text("❌ Не удалось обработать видео. Проверь ссылку.")
+                return
+            
+            # Отправляем каждый кружочек
+            total = len(video_files)
+            for i, video_path in enumerate(video_files, 1):
                 try:
-                    os.remove(video_path)
+                    with open(video_path, 'rb') as video_file:
+                        await update.message.reply_video_note(
+                            video_note=video_file,
+                            duration=None  # Telegram сам определит длительность
+                        )
+                    
+                    # Удаляем временный файл после успешной отправки
+                    try:
+                        os.remove(video_path)
+                    except Exception as e:
+                        logger.warning(f"Не удалось удалить файл {video_path}: {e}")
+                    
+                    logger.info(f"Отправлен кружочек {i}/{total} пользователю {chat_id}")
+                    
                 except Exception as e:
-                    logger.warning(f"Не удалось удалить файл {video_path}: {e}")
-                
-                logger.info(f"Отправлен кружочек {i}/{total} пользователю {chat_id}")
-                
-            except Exception as e:
-                logger.error(f"Ошибка отправки кружочка {i}: {e}")
-                # Продолжаем отправку остальных, даже если один не удался
+                    logger.error(f"Ошибка отправки кружочка {i}: {e}")
+                    # Продолжаем отправку остальных, даже если один не удался
+                    try:
+                        os.remove(video_path)
+                    except:
+                        pass
+            
+            # Обновляем статус
+            await status_message.edit_text(f"✅ Готово! Отправлено {total} кружочков!")
+            logger.info(f"Успешно обработано видео для пользователя {chat_id}: {total} кружочков")
+            
+        except Exception as e:
+            error_msg = str(e)
+            logger.error(f"Ошибка обработки видео для пользователя {chat_id}: {error_msg}")
+            
+            # Пытаемся дать более понятное сообщение об ошибке
+            if isinstance(e, quotas.QuotaExceeded):
+                user_error = f"❌ {error_msg}"
+            elif "too big" in error_msg.lower() or "file is too big" in error_msg.lower() or "file_size" in error_msg.lower():
+                file_size_mb = file_size / (1024 * 1024) if file_size else "?"
+                user_error = (
+                    f"❌ Файл слишком большой ({file_size_mb:.1f} МБ, если известно).\n\n"
+                    f"Telegram Bot API позволяет скачивать файлы до 20 МБ.\n\n"
+                    f"Что делать?\n"
+                    f"• Отправь ссылку на видео (YouTube, Rutube, и т.д.)\n"
+                    f"• Или сожми видео перед отправкой\n"
+                    f"• Или загрузи видео в облако и отправь ссылку"
+                )
+            elif "FFmpeg" in error_msg or "ffprobe" in error_msg:
+                user_error = "❌ Ошибка обработки видео. Убедитесь, что FFmpeg установлен и доступен."
+            elif "yt-dlp" in error_msg.lower() or "download" in error_msg.lower():
+                user_error = "❌ Не удалось скачать видео. Проверь ссылку или попробуй другую платформу."
+            else:
+                user_error = f"❌ Ошибка: {error_msg}"
+            
+            await status_message.edit_text(user_error)
+            
+            # Очищаем временные файлы в случае ошибки
+            for video_path in video_files:
                 try:
-                    os.remove(video_path)
+                    if os.path.exists(video_path):
+                        os.remove(video_path)
                 except:
                     pass
-        
-        # Обновляем статус
-        await status_message.edit_text(f"✅ Готово! Отправлено {total} кружочков!")
-        logger.info(f"Успешно обработано видео для пользователя {chat_id}: {total} кружочков")
-        
-    except Exception as e:
-        error_msg = str(e)
-        logger.error(f"Ошибка обработки видео для пользователя {chat_id}: {error_msg}")
-        
-        # Пытаемся дать более понятное сообщение об ошибке
-        if "too big" in error_msg.lower() or "file is too big" in error_msg.lower() or "file_size" in error_msg.lower():
-            file_size_mb = file_size / (1024 * 1024) if file_size else "?"
-            user_error = (
-                f"❌ Файл слишком большой ({file_size_mb:.1f} МБ, если известно).\n\n"
-                f"Telegram Bot API позволяет скачивать файлы до 20 МБ.\n\n"
-                f"Что делать?\n"
-                f"• Отправь ссылку на видео (YouTube, Rutube, и т.д.)\n"
-                f"• Или сожми видео перед отправкой\n"
-                f"• Или загрузи видео в облако и отправь ссылку"
-            )
-        elif "FFmpeg" in error_msg or "ffprobe" in error_msg:
-            user_error = "❌ Ошибка обработки видео. Убедитесь, что FFmpeg установлен и доступен."
-        elif "yt-dlp" in error_msg.lower() or "download" in error_msg.lower():
-            user_error = "❌ Не удалось скачать видео. Проверь ссылку или попробуй другую платформу."
-        else:
-            user_error = f"❌ Ошибка: {error_msg}"
-        
-        await status_message.edit_text(user_error)
-        
-        # Очищаем временные файлы в случае ошибки
-        for video_path in video_files:
-            try:
-                if os.path.exists(video_path):
-                    os.remove(video_path)
-            except:
-                pass
-        
-        # Удаляем исходный файл из Telegram
-        if temp_video_path and os.path.exists(temp_video_path):
-            try:
-                os.remove(temp_video_path)
-            except:
-                pass
+        finally:
+            # Удаляем исходный файл из Telegram (и после успешной обработки тоже)
+            if temp_video_path and os.path.exists(temp_video_path):
+                try:
+                    os.remove(temp_video_path)
+                except:
+                    pass
+    
+    logger.info(f"Задание пользователя {chat_id} завершено за {job['elapsed']:.1f} с, "
+                f"профиль: {job.get('profile', {}).get('name')}")
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -261,99 +309,124 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     chat_id = update.message.chat_id
     logger.info(f"Получена ссылка от пользователя {chat_id}: {message_text}")
     
-    # Отправляем сообщение о начале обработки
-    status_message = await update.message.reply_text("⏳ Скачиваю и обрабатываю видео...")
-    
-    video_files = []
-    try:
-        # Обрабатываем видео
-        video_files = await process_video_to_circles(message_text, config.DEFAULT_SEGMENT_DURATION)
+    # Регистрируем задание: по числу активных заданий выбирается профиль кодирования,
+    # а по завершении израсходованные ресурсы списываются с квоты пользователя
+    with encoding_profiles.track_job(chat_id=chat_id, kind="link") as job, quotas.account_job(chat_id, job):
+        # Отправляем сообщение о начале обработки
+        status_message = await update.message.reply_text("⏳ Скачиваю и обрабатываю видео...")
         
-        if not video_files:
-            await status_message.edit_text("❌ Не удалось обработать видео. Проверь ссылку.")
-            return
-        
-        # Отправляем каждый кружочек
-        total = len(video_files)
-        for i, video_path in enumerate(video_files, 1):
-            try:
-                with open(video_path, 'rb') as video_file:
-                    await update.message.reply_video_note(
-                        video_note=video_file,
-                        duration=None  # Telegram сам определит длительность
-                    )
-                
-                # Удаляем временный файл после успешной отправки
+        video_files = []
+        try:
+            # Проверяем ограничения по метаданным, до скачивания самого видео
+            video_info = await extract_video_info(message_text)
+            job["reservation"] = quotas.check_request(chat_id, duration=video_info["duration"],
+                                                      download_bytes=video_info["filesize"])
+            
+            # Обрабатываем видео
+            video_files = await process_video_to_circles(message_text, config.DEFAULT_SEGMENT_DURATION)
+            
+            if not video_files:
+                await status_message.edit_text("❌ Не удалось обработать видео. Проверь ссылку.")
+                return
+            
+            # Отправляем каждый кружочек
+            total = len(video_files)
+            for i, video_path in enumerate(video_files, 1):
                 try:
-                    os.remove(video_path)
+                    with open(video_path, 'rb') as video_file:
+                        await update.message.reply_video_note(
+                            video_note=video_file,
+                            duration=None  # Telegram сам определит длительность
+                        )
+                    
+                    # Удаляем временный файл после успешной отправки
+                    try:
+                        os.remove(video_path)
+                    except Exception as e:
+                        logger.warning(f"Не удалось удалить файл {video_path}: {e}")
+                    
+                    logger.info(f"Отправлен кружочек {i}/{total} пользователю {chat_id}")
+                    
                 except Exception as e:
-                    logger.warning(f"Не удалось удалить файл {video_path}: {e}")
-                
-                logger.info(f"Отправлен кружочек {i}/{total} пользователю {chat_id}")
-                
-            except Exception as e:
-                logger.error(f"Ошибка отправки кружочка {i}: {e}")
-                # Продолжаем отправку остальных, даже если один не удался
+                    logger.error(f"Ошибка отправки кружочка {i}: {e}")
+                    # Продолжаем отправку остальных, даже если один не удался
+                    try:
+                        os.remove(video_path)
+                    except:
+                        pass
+            
+            # Обновляем статус
+            await status_message.edit_text(f"✅ Готово! Отправлено {total} кружочков!")
+            logger.info(f"Успешно обработано видео для пользователя {chat_id}: {total} кружочков")
+            
+        except Exception as e:
+            error_msg = str(e)
+            logger.error(f"Ошибка обработки видео для пользователя {chat_id}: {error_msg}")
+            
+            # Пытаемся дать более понятное сообщение об ошибке
+            if isinstance(e, quotas.QuotaExceeded):
+                user_error = f"❌ {error_msg}"
+            elif "too big" in error_msg.lower() or "file is too big" in error_msg.lower():
+                user_error = (
+                    f"❌ Файл слишком большой.\n\n"
+                    f"Telegram Bot API позволяет скачивать файлы до 20 МБ.\n\n"
+                    f"Что делать?\n"
+                    f"• Отправь ссылку на видео (YouTube, Rutube, и т.д.)\n"
+                    f"• Или сожми видео перед отправкой\n"
+                    f"• Или загрузи видео в облако и отправь ссылку"
+                )
+            elif "FFmpeg" in error_msg or "ffprobe" in error_msg:
+                user_error = "❌ Ошибка обработки видео. Убедитесь, что FFmpeg установлен и доступен."
+            elif "yt-dlp" in error_msg.lower() or "download" in error_msg.lower():
+                user_error = "❌ Не удалось скачать видео. Проверь ссылку или попробуй другую платформу."
+            else:
+                user_error = f"❌ Ошибка: {error_msg}"
+            
+            await status_message.edit_text(user_error)
+            
+            # Очищаем временные файлы в случае ошибки
+            for video_path in video_files:
                 try:
-                    os.remove(video_path)
+                    if os.path.exists(video_path):
+                        os.remove(video_path)
                 except:
                     pass
-        
-        # Обновляем статус
-        await status_message.edit_text(f"✅ Готово! Отправлено {total} кружочков!")
-        logger.info(f"Успешно обработано видео для пользователя {chat_id}: {total} кружочков")
-        
-    except Exception as e:
-        error_msg = str(e)
-        logger.error(f"Ошибка обработки видео для пользователя {chat_id}: {error_msg}")
-        
-        # Пытаемся дать более понятное сообщение об ошибке
-        if "too big" in error_msg.lower() or "file is too big" in error_msg.lower():
-            user_error = (
-                f"❌ Файл слишком большой.\n\n"
-                f"Telegram Bot API позволяет скачивать файлы до 20 МБ.\n\n"
-                f"Что делать?\n"
-                f"• Отправь ссылку на видео (YouTube, Rutube, и т.д.)\n"
-                f"• Или сожми видео перед отправкой\n"
-                f"• Или загрузи видео в облако и отправь ссылку"
-            )
-        elif "FFmpeg" in error_msg or "ffprobe" in error_msg:
-            user_error = "❌ Ошибка обработки видео. Убедитесь, что FFmpeg установлен и доступен."
-        elif "yt-dlp" in error_msg.lower() or "download" in error_msg.lower():
-            user_error = "❌ Не удалось скачать видео. Проверь ссылку или попробуй другую платформу."
-        else:
-            user_error = f"❌ Ошибка: {error_msg}"
-        
-        await status_message.edit_text(user_error)
-        
-        # Очищаем временные файлы в случае ошибки
-        for video_path in video_files:
-            try:
-                if os.path.exists(video_path):
-                    os.remove(video_path)
-            except:
-                pass
+    
+    logger.info(f"Задание пользователя {chat_id} завершено за {job['elapsed']:.1f} с, "
+                f"профиль: {job.get('profile', {}).get('name')}")
 
 
-def main() -> None:
-    """Основная функция запуска бота"""
-    # Проверяем доступность FFmpeg при запуске
-    if not check_ffmpeg_available():
-        logger.error("FFmpeg недоступен! Бот не сможет обрабатывать видео.")
-        print("\n" + "="*60)
-        print("ОШИБКА: FFmpeg не найден или недоступен!")
-        print("="*60)
-        print("\nУбедитесь, что FFmpeg установлен и добавлен в PATH.")
-        print("Проверьте установку командой: ffmpeg -version")
-        print("\nИнструкции по установке FFmpeg:")
-        print("Windows: https://www.ffmpeg.org/download.html")
-        print("  - Скачайте и распакуйте")
-        print("  - Добавьте папку bin в переменную PATH")
-        print("="*60 + "\n")
-        return
+def build_application(token: str, base_url: Optional[str] = None, base_file_url: Optional[str] = None,
+                      concurrent_updates: Union[bool, int] = False, quote_replies: bool = False) -> Application:
+    """
+    Создаёт приложение бота и регистрирует обработчики.
     
-    # Создаём приложение
-    app = Application.builder().token(BOT_TOKEN).build()
+    Args:
+        token: Токен бота
+        base_url: Адрес Bot API (None - официальный сервер Telegram)
+        base_file_url: Адрес для скачивания файлов (None - официальный сервер Telegram)
+        concurrent_updates: Обрабатывать ли обновления параллельно (True или максимум одновременных)
+        quote_replies: Отвечать цитатой на сообщение пользователя (нужно loadtest.py,
+            чтобы сопоставлять ответы с запросами)
+        
+    Returns:
+        Настроенный объект Application
+    """
+    from telegram.ext import Application, CommandHandler, Defaults, MessageHandler, filters
+    
+    # Глубина очереди для адаптивных профилей: и ждущие, и обрабатываемые обновления
+    update_queue = UpdateQueue()
+    encoding_profiles.set_queue_depth_provider(lambda: update_queue.pending)
+    
+    builder = Application.builder().token(token).concurrent_updates(concurrent_updates)
+    builder = builder.update_queue(update_queue)
+    if quote_replies:
+        builder = builder.defaults(Defaults(do_quote=True))
+    if base_url:
+        builder = builder.base_url(base_url)
+    if base_file_url:
+        builder = builder.base_file_url(base_file_url)
+    app = builder.build()
     
     # Регистрируем обработчики
     # Важно: обработчик видео должен быть ПЕРЕД текстовыми сообщениями
@@ -395,6 +468,42 @@ def main() -> None:
     
     app.add_error_handler(error_handler)
     
+    return app
+
+
+def main() -> None:
+    """Основная функция запуска бота"""
+    from dotenv import load_dotenv
+    from telegram import Update
+    
+    # Загрузка переменных окружения
+    load_dotenv()
+    bot_token = os.getenv('BOT_TOKEN')
+    
+    if not bot_token:
+        raise ValueError("BOT_TOKEN не найден в переменных окружения. Создайте файл .env с BOT_TOKEN=your_token")
+    
+    # Проверяем доступность FFmpeg при запуске
+    if not check_ffmpeg_available():
+        logger.error("FFmpeg недоступен! Бот не сможет обрабатывать видео.")
+        print("\n" + "="*60)
+        print("ОШИБКА: FFmpeg не найден или недоступен!")
+        print("="*60)
+        print("\nУбедитесь, что FFmpeg установлен и добавлен в PATH.")
+        print("Проверьте установку командой: ffmpeg -version")
+        print("\nИнструкции по установке FFmpeg:")
+        print("Windows: https://www.ffmpeg.org/download.html")
+        print("  - Скачайте и распакуйте")
+        print("  - Добавьте папку bin в переменную PATH")
+        print("="*60 + "\n")
+        return
+    
+    # Убираем кружочки, оставшиеся в памяти после прошлого запуска
+    segment_buffers.cleanup_stale()
+    
+    # Создаём приложение
+    app = build_application(bot_token)
+    
     
     logger.info("Бот запущен и готов к работе!")
     print("Бот запущен! Нажмите Ctrl+C для остановки.")
@@ -10,6 +10,20 @@ DEFAULT_SEGMENT_DURATION = 10
 MIN_SEGMENT_DURATION = 5
 MAX_SEGMENT_DURATION = 15
 
+# Ограничения на один запрос (None - без ограничения)
+MAX_SOURCE_DURATION = 30 * 60  # Максимальная длительность исходного видео (секунды)
+MAX_CIRCLES_PER_REQUEST = 180  # Максимум кружочков из одного видео (30 мин по 10 с)
+
+# Квоты на одного пользователя за скользящее окно QUOTA_WINDOW (None - без ограничения)
+QUOTA_WINDOW = 60 * 60  # 1 час
+QUOTA_MAX_CPU_SECONDS = 20 * 60  # Процессорное время FFmpeg (секунды)
+QUOTA_MAX_DOWNLOAD_BYTES = 2 * 1024 * 1024 * 1024  # 2 ГБ
+QUOTA_MAX_CIRCLES = 200
+
+# Выбирать границы отрезков по сменам сцен и паузам в звуке (см. segment_planner.py)
+# вместо нарезки ровно через DEFAULT_SEGMENT_DURATION секунд
+SMART_SEGMENT_BOUNDARIES = False
+
 # Максимальный размер файла для Telegram video_note (байты)
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10 МБ
 
@@ -20,9 +34,42 @@ FFMPEG_PRESET = "fast"
 FFMPEG_CRF = 23  # Качество (18-28, меньше = лучше качество, больше размер)
 FFMPEG_AUDIO_BITRATE = "128k"
 
+# Адаптивные профили кодирования: при росте нагрузки (очередь заданий и загрузка
+# CPU) выбираются более быстрые пресеты, в простое - более качественные.
+# Профили упорядочены от лучшего качества к самому быстрому; берётся первый,
+# у которого max_queue и max_cpu (load average на ядро) не превышены.
+# Если ADAPTIVE_ENCODING = False, используются FFMPEG_PRESET/FFMPEG_CRF/VIDEO_SIZE.
+ADAPTIVE_ENCODING = True
+ENCODING_PROFILES = [
+    {"name": "quality", "preset": "medium", "crf": 21, "size": 640, "max_queue": 1, "max_cpu": 0.5},
+    {"name": "balanced", "preset": "fast", "crf": 23, "size": 640, "max_queue": 4, "max_cpu": 0.85},
+    {"name": "fast", "preset": "veryfast", "crf": 25, "size": 512, "max_queue": 12, "max_cpu": 1.5},
+    {"name": "burst", "preset": "ultrafast", "crf": 27, "size": 384, "max_queue": None, "max_cpu": None},
+]
+
 # Путь к временной папке
 TEMP_VIDEOS_DIR = "temp_videos"
 
+# Готовые кружочки для бота пишутся в память (tmpfs), а не на диск: они живут
+# секунды до отправки. None - всегда писать на диск (TEMP_VIDEOS_DIR).
+# Если папки нет (например, в Windows) или бюджет исчерпан, используется диск.
+SEGMENT_MEMORY_DIR = "/dev/shm"
+SEGMENT_MEMORY_BUDGET = 256 * 1024 * 1024  # 256 МБ на все процессы
+
+# Скачивание по ссылкам (yt-dlp): отдельный пул потоков, чтобы медленные
+# скачивания не занимали пул по умолчанию
+DOWNLOAD_WORKERS = 4
+# Сколько секунд и для скольких ссылок хранить извлечённые метаданные
+# (ссылки на файлы у многих сайтов со временем протухают)
+DOWNLOAD_INFO_TTL = 10 * 60
+DOWNLOAD_INFO_CACHE_SIZE = 256
+
+# Папка для кеша (возможности FFmpeg, метаданные исходников), можно удалять в любой момент
+CACHE_DIR = ".cache"
+
+# Сколько записей о метаданных исходников хранить в кеше
+SOURCE_CACHE_MAX_ENTRIES = 1000
+
 # Пути к FFmpeg (если не в PATH, укажите полные пути)
 # Оставьте None для автоматического поиска в PATH
 FFMPEG_PATH = r"C:\Program Files\ImageMagick-7.0.10-Q16-HDRI\ffmpeg.exe"  # Полный путь к ffmpeg
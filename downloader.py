@@ -0,0 +1,189 @@
+"""Скачивание видео по ссылкам через yt-dlp.
+
+yt-dlp синхронный, поэтому работает в отдельном пуле потоков ограниченного
+размера (config.DOWNLOAD_WORKERS): медленные скачивания не занимают пул
+по умолчанию, которым пользуются остальные части бота. В каждом потоке
+пула один раз создаётся настроенный YoutubeDL и дальше переиспользуется.
+
+Сначала извлекаются метаданные (id, длительность, форматы) - без скачивания,
+чтобы проверки квот и кеши могли отказать заранее. Результат кешируется на
+config.DOWNLOAD_INFO_TTL секунд, а одновременные запросы одной ссылки
+ждут одно извлечение. Скачивание берёт уже извлечённые метаданные, и
+путь к файлу берётся из ответа yt-dlp.
+"""
+
+import asyncio
+import copy
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Общие настройки YoutubeDL; outtmpl задаётся на каждое скачивание
+YDL_OPTIONS = {
+    'format': 'best[ext=mp4]/best',
+    'quiet': True,
+    'no_warnings': True,
+    'noprogress': True,
+}
+
+_executor: Optional[ThreadPoolExecutor] = None
+_local = threading.local()
+
+# Кеш метаданных: ссылка -> (время извлечения, краткая сводка, info для скачивания)
+_info_cache: "OrderedDict[str, Tuple[float, Dict, Dict]]" = OrderedDict()
+
+# Извлечения, которые выполняются прямо сейчас (ссылка -> future из пула)
+_inflight: Dict[str, Future] = {}
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Пул потоков для yt-dlp (создаётся при первом обращении)."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=config.DOWNLOAD_WORKERS, thread_name_prefix="yt-dlp")
+    return _executor
+
+
+def _get_ydl():
+    """YoutubeDL текущего потока пула (создаётся один раз на поток)."""
+    ydl = getattr(_local, "ydl", None)
+    if ydl is None:
+        import yt_dlp  # Тяжёлый импорт: загружаем только когда нужно скачивать
+        ydl = yt_dlp.YoutubeDL(dict(YDL_OPTIONS))
+        _local.ydl = ydl
+    return ydl
+
+
+def _summarize(info: Dict) -> Dict:
+    """Краткая сводка метаданных для проверок до скачивания."""
+    filesize = info.get("filesize") or info.get("filesize_approx")
+    if not filesize and info.get("requested_formats"):
+        # Видео и звук скачиваются отдельно и потом склеиваются
+        sizes = [f.get("filesize") or f.get("filesize_approx") for f in info["requested_formats"]]
+        filesize = sum(sizes) if all(sizes) else None
+    return {
+        "id": info.get("id"),
+        "title": info.get("title"),
+        "duration": info.get("duration"),
+        "filesize": filesize,
+        "format_id": info.get("format_id"),
+        "formats": [
+            {
+                "format_id": f.get("format_id"),
+                "ext": f.get("ext"),
+                "width": f.get("width"),
+                "height": f.get("height"),
+                "filesize": f.get("filesize") or f.get("filesize_approx"),
+            }
+            for f in info.get("formats") or []
+        ],
+    }
+
+
+def _extract(url: str) -> Tuple[Dict, Dict]:
+    """Извлекает метаданные в потоке пула; возвращает (сводка, info для скачивания)."""
+    ydl = _get_ydl()
+    info = ydl.extract_info(url, download=False)
+    # Так же yt-dlp готовит info для --load-info-json: без служебных полей,
+    # чтобы повторный process_ie_result заново выбрал формат и путь
+    return _summarize(info), ydl.sanitize_info(info, remove_private_keys=True)
+
+
+def _download(info: Dict, output_template: str) -> str:
+    """Скачивает по уже извлечённым метаданным в потоке пула; возвращает путь к файлу."""
+    ydl = _get_ydl()
+    ydl.params['outtmpl'] = {'default': output_template}
+    result = ydl.process_ie_result(info, download=True)
+
+    downloads = result.get("requested_downloads") or []
+    filepath = downloads[-1].get("filepath") if downloads else result.get("filepath")
+    if not filepath or not Path(filepath).exists():
+        raise Exception("yt-dlp не вернул путь к скачанному файлу")
+    return filepath
+
+
+def _cached(url: str) -> Optional[Tuple[Dict, Dict]]:
+    entry = _info_cache.get(url)
+    if entry is None:
+        return None
+    if time.time() - entry[0] > config.DOWNLOAD_INFO_TTL:
+        # Ссылки на сами файлы у многих сайтов со временем протухают
+        del _info_cache[url]
+        return None
+    _info_cache.move_to_end(url)
+    return entry[1], entry[2]
+
+
+def forget(url: str) -> None:
+    """Удаляет метаданные ссылки из кеша (например, после неудачного скачивания)."""
+    _info_cache.pop(url, None)
+
+
+async def _get_info(url: str) -> Tuple[Dict, Dict]:
+    """Метаданные из кеша или из yt-dlp; одновременные запросы ждут одно извлечение."""
+    cached = _cached(url)
+    if cached is not None:
+        return cached
+
+    future = _inflight.get(url)
+    if future is None:
+        future = get_executor().submit(_extract, url)
+        _inflight[url] = future
+        future.add_done_callback(lambda _: _inflight.pop(url, None))
+
+    summary, info = await asyncio.wrap_future(future)
+    if url not in _info_cache:
+        _info_cache[url] = (time.time(), summary, info)
+        while len(_info_cache) > config.DOWNLOAD_INFO_CACHE_SIZE:
+            _info_cache.popitem(last=False)
+    return summary, info
+
+
+async def extract_info(url: str) -> Dict:
+    """
+    Получает метаданные видео по ссылке, ничего не скачивая.
+
+    Args:
+        url: Ссылка на видео
+
+    Returns:
+        Словарь: id, title, duration, filesize (None, если неизвестны),
+        format_id выбранного формата и formats - список доступных форматов
+    """
+    summary, _ = await _get_info(url)
+    return copy.deepcopy(summary)
+
+
+async def download(url: str, target_dir: Path) -> str:
+    """
+    Скачивает видео по ссылке, используя ранее извлечённые метаданные (если есть).
+
+    Args:
+        url: Ссылка на видео
+        target_dir: Папка для скачанного файла
+
+    Returns:
+        Путь к скачанному файлу
+
+    Raises:
+        Exception: Если не удалось скачать видео
+    """
+    _, info = await _get_info(url)
+    # Уникальное имя: одновременные скачивания в одну папку не мешают друг другу
+    output_template = str(target_dir / f"source_{uuid.uuid4().hex[:12]}.%(ext)s")
+    try:
+        return await asyncio.wrap_future(
+            get_executor().submit(_download, copy.deepcopy(info), output_template)
+        )
+    except Exception:
+        forget(url)
+        raise
@@ -0,0 +1,148 @@
+"""Адаптивный выбор профиля кодирования в зависимости от нагрузки"""
+
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Количество заданий, зарегистрированных через track_job (сейчас выполняются)
+_active_jobs = 0
+
+# Дополнительный источник глубины очереди: работа, которую track_job не видит
+# (например, обновления, ждущие в очереди бота, см. bot.UpdateQueue)
+_queue_depth_provider: Optional[Callable[[], int]] = None
+
+# Запись о текущем задании (профиль, статистика); своя у каждой asyncio-задачи
+_current_job: ContextVar[Optional[Dict]] = ContextVar("current_job", default=None)
+
+
+@contextmanager
+def track_job(**fields) -> Iterator[Dict]:
+    """
+    Регистрирует задание в счётчике нагрузки на время его выполнения.
+
+    Args:
+        **fields: Произвольные поля записи о задании (например, chat_id)
+
+    Yields:
+        Словарь-запись о задании; video_processor дописывает в неё выбранный профиль
+    """
+    global _active_jobs
+    _active_jobs += 1
+    record = dict(fields, started=time.time())
+    token = _current_job.set(record)
+    try:
+        yield record
+    finally:
+        _current_job.reset(token)
+        _active_jobs -= 1
+        record["elapsed"] = time.time() - record["started"]
+
+
+def set_queue_depth_provider(provider: Optional[Callable[[], int]]) -> None:
+    """
+    Задаёт функцию, возвращающую число ожидающих и выполняющихся заданий.
+
+    Глубиной очереди считается большее из этого числа и количества
+    заданий в track_job. None - считать только track_job.
+    """
+    global _queue_depth_provider
+    _queue_depth_provider = provider
+
+
+def current_job() -> Optional[Dict]:
+    """Запись о задании, в контексте которого выполняется код (или None)."""
+    return _current_job.get()
+
+
+def current_load() -> Dict:
+    """
+    Текущая нагрузка: глубина очереди и загрузка CPU.
+
+    Загрузка CPU - load average за минуту на одно ядро; там, где его нет
+    (Windows), считается нулевой, и профиль выбирается только по очереди.
+    Глубина очереди - выполняющиеся задания, а если задан источник
+    (set_queue_depth_provider), то и ожидающие.
+    """
+    queue_depth = _active_jobs
+    if _queue_depth_provider is not None:
+        queue_depth = max(queue_depth, _queue_depth_provider())
+    try:
+        cpu = os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        cpu = 0.0
+    return {"queue_depth": queue_depth, "cpu": cpu}
+
+
+def static_profile() -> Dict:
+    """Профиль из статических настроек config (когда адаптация выключена)."""
+    return {
+        "name": "static",
+        "preset": config.FFMPEG_PRESET,
+        "crf": config.FFMPEG_CRF,
+        "size": config.VIDEO_SIZE,
+    }
+
+
+def select_profile(load: Optional[Dict] = None) -> Dict:
+    """
+    Выбирает профиль кодирования по текущей нагрузке.
+
+    Args:
+        load: Нагрузка в формате current_load() (по умолчанию - текущая)
+
+    Returns:
+        Копия профиля (name, preset, crf, size) с добавленной нагрузкой на момент выбора
+    """
+    if not config.ADAPTIVE_ENCODING or not config.ENCODING_PROFILES:
+        return static_profile()
+
+    load = load or current_load()
+    chosen = config.ENCODING_PROFILES[-1]
+    for profile in config.ENCODING_PROFILES:
+        queue_ok = profile.get("max_queue") is None or load["queue_depth"] <= profile["max_queue"]
+        cpu_ok = profile.get("max_cpu") is None or load["cpu"] <= profile["max_cpu"]
+        if queue_ok and cpu_ok:
+            chosen = profile
+            break
+
+    return {
+        "name": chosen["name"],
+        "preset": chosen["preset"],
+        "crf": chosen["crf"],
+        "size": chosen["size"],
+        "queue_depth": load["queue_depth"],
+        "cpu": round(load["cpu"], 2),
+    }
+
+
+def fit_profile_to_source(profile: Dict, width: Optional[int], height: Optional[int],
+                          mode: str = config.VIDEO_CROP_MODE) -> Dict:
+    """
+    Не даёт апскейлить маленькие исходники: если исходник меньше размера
+    профиля, кружочек делается в родном разрешении.
+
+    Args:
+        profile: Профиль кодирования
+        width: Ширина исходника (None - неизвестна)
+        height: Высота исходника (None - неизвестна)
+        mode: Режим "crop" (важна меньшая сторона) или "pad" (важна большая)
+
+    Returns:
+        Профиль с, возможно, уменьшенным size и флагом native
+    """
+    if not width or not height:
+        return profile
+
+    native = min(width, height) if mode == "crop" else max(width, height)
+    native -= native % 2  # libx264 требует чётные размеры
+    if native >= profile["size"] or native <= 0:
+        return profile
+
+    return dict(profile, size=native, native=True)
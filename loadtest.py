@@ -0,0 +1,544 @@
+"""Нагрузочный тест бота с локальной заглушкой Telegram Bot API.
+
+Поднимает HTTP-сервер, который имитирует Bot API (getUpdates, getFile,
+скачивание файлов, sendMessage, sendVideoNote, editMessageText) и раздаёт
+видео по прямым ссылкам для yt-dlp. Бот из bot.py запускается в этом же
+процессе и опрашивает заглушку вместо api.telegram.org, поэтому сеть не нужна.
+
+Примеры:
+    python loadtest.py --users 10 --jobs 40 --rate 2
+    python loadtest.py --users 20 --jobs 100 --rate 5 --concurrent-updates 8 -o load.json
+
+Запросы подаются строго по расписанию (--rate), не дожидаясь ответов на
+предыдущие: у одного пользователя может быть несколько запросов в работе.
+Бот отвечает цитатой, и ответы сопоставляются с запросами по message_id.
+Задержки считаются от запланированного времени отправки, поэтому время
+ожидания в очереди, когда бот не успевает, тоже попадает в p95/p99.
+
+Квоты на пользователя на время теста отключены (иначе вместо пропускной
+способности измерялись бы отказы); с --quotas они действуют, а отказы по
+квотам считаются отдельно от ошибок.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+
+FAKE_TOKEN = "123456:LOADTEST"
+
+# Фрагменты ответов бота на quotas.QuotaExceeded: такие отказы считаются отдельно от ошибок
+QUOTA_REPLIES = ("Лимит ", "Видео слишком длинное", "за один раз можно не больше")
+
+
+class FakeBotAPI:
+    """
+    Заглушка Telegram Bot API и файлового сервера для yt-dlp.
+
+    Работает в отдельном потоке. О каждом ответе бота (sendMessage,
+    editMessageText, sendVideoNote) сообщает через on_event(method, params, result).
+    """
+
+    def __init__(self, media: bytes, on_event: Callable[[str, Dict, Dict], None], host: str = "127.0.0.1"):
+        self.media = media
+        self.on_event = on_event
+        self._cond = threading.Condition()
+        self._updates: List[Dict] = []
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self.requests: Dict[str, int] = {}
+        self.uploaded_bytes = 0
+
+        self._httpd = ThreadingHTTPServer((host, 0), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        with self._cond:
+            self._cond.notify_all()
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _new_message_id(self) -> int:
+        with self._cond:
+            message_id = self._next_message_id
+            self._next_message_id += 1
+            return message_id
+
+    def _message(self, chat_id: int, **fields) -> Dict:
+        message = {
+            "message_id": self._new_message_id(),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"User{chat_id}"},
+        }
+        message.update(fields)
+        return message
+
+    def push_text(self, chat_id: int, text: str) -> int:
+        """Добавляет в очередь getUpdates текстовое сообщение пользователя; возвращает его message_id."""
+        return self._push(self._message(chat_id, text=text))
+
+    def push_video(self, chat_id: int, file_id: str) -> int:
+        """Добавляет в очередь getUpdates сообщение с видеофайлом; возвращает его message_id."""
+        return self._push(self._message(chat_id, video={
+            "file_id": file_id,
+            "file_unique_id": file_id,
+            "width": 640,
+            "height": 640,
+            "duration": 0,
+            "mime_type": "video/mp4",
+            "file_size": len(self.media),
+        }))
+
+    def _push(self, message: Dict) -> int:
+        with self._cond:
+            self._updates.append({"update_id": self._next_update_id, "message": message})
+            self._next_update_id += 1
+            self._cond.notify_all()
+        return message["message_id"]
+
+    def get_updates(self, offset: int, timeout: float) -> List[Dict]:
+        """Long polling: ждёт новые обновления не дольше timeout секунд."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return list(self._updates)
+
+    def handle_method(self, method: str, params: Dict) -> object:
+        """Формирует ответ на вызов метода Bot API."""
+        chat_id = int(params.get("chat_id", 0) or 0)
+
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot",
+                    "can_join_groups": False, "can_read_all_group_messages": False,
+                    "supports_inline_queries": False}
+        if method == "getUpdates":
+            return self.get_updates(int(params.get("offset", 0) or 0), float(params.get("timeout", 0) or 0))
+        if method == "getFile":
+            file_id = params["file_id"]
+            return {"file_id": file_id, "file_unique_id": file_id,
+                    "file_size": len(self.media), "file_path": f"videos/{file_id}.mp4"}
+        if method == "sendMessage":
+            result = self._message(chat_id, text=params.get("text", ""))
+        elif method == "editMessageText":
+            result = self._message(chat_id, text=params.get("text", ""))
+            result["message_id"] = int(params["message_id"])
+        elif method == "sendVideoNote":
+            result = self._message(chat_id, video_note={
+                "file_id": f"note{self._next_message_id}",
+                "file_unique_id": f"note{self._next_message_id}",
+                "length": 640,
+                "duration": 0,
+            })
+        else:
+            # deleteWebhook, close и прочие служебные методы
+            return True
+
+        self.on_event(method, params, result)
+        return result
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, body: bytes, content_type: str, extra: Optional[Dict] = None,
+                      head_only: bool = False) -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (extra or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                if not head_only:
+                    self.wfile.write(body)
+
+            def _read_params(self) -> Tuple[Dict, int]:
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                content_type = self.headers.get("Content-Type", "")
+                if content_type.startswith("application/json"):
+                    return json.loads(body or b"{}"), 0
+                if content_type.startswith("multipart/form-data"):
+                    message = BytesParser(policy=policy.HTTP).parsebytes(
+                        b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body
+                    )
+                    params, uploaded = {}, 0
+                    for part in message.iter_parts():
+                        payload = part.get_payload(decode=True) or b""
+                        if part.get_filename():
+                            uploaded += len(payload)
+                        else:
+                            params[part.get_param("name", header="content-disposition")] = payload.decode()
+                    return params, uploaded
+                return {key: values[0] for key, values in parse_qs(body.decode()).items()}, 0
+
+            def _serve_media(self, head_only: bool) -> None:
+                media = api.media
+                range_header = self.headers.get("Range", "")
+                if range_header.startswith("bytes="):
+                    start_str, _, end_str = range_header[6:].partition("-")
+                    start = int(start_str or 0)
+                    end = int(end_str) if end_str else len(media) - 1
+                    self._send(206, media[start:end + 1], "video/mp4",
+                               {"Content-Range": f"bytes {start}-{end}/{len(media)}", "Accept-Ranges": "bytes"},
+                               head_only)
+                else:
+                    self._send(200, media, "video/mp4", {"Accept-Ranges": "bytes"}, head_only)
+
+            def _route_get(self, head_only: bool) -> None:
+                path = unquote(urlparse(self.path).path)
+                if path.startswith("/media/") or path.startswith(f"/file/bot{FAKE_TOKEN}/"):
+                    self._serve_media(head_only)
+                elif path.startswith(f"/bot{FAKE_TOKEN}/"):
+                    self._api_call(path, {})
+                else:
+                    self._send(404, b"not found", "text/plain", head_only=head_only)
+
+            def do_HEAD(self):
+                self._route_get(head_only=True)
+
+            def do_GET(self):
+                self._route_get(head_only=False)
+
+            def do_POST(self):
+                path = unquote(urlparse(self.path).path)
+                if not path.startswith(f"/bot{FAKE_TOKEN}/"):
+                    self._send(404, b"not found", "text/plain")
+                    return
+                params, uploaded = self._read_params()
+                with api._cond:
+                    api.uploaded_bytes += uploaded
+                self._api_call(path, params)
+
+            def _api_call(self, path: str, params: Dict) -> None:
+                method = path.rsplit("/", 1)[-1]
+                with api._cond:
+                    api.requests[method] = api.requests.get(method, 0) + 1
+                try:
+                    body = {"ok": True, "result": api.handle_method(method, params)}
+                except Exception as e:
+                    body = {"ok": False, "error_code": 400, "description": f"Bad Request: {e}"}
+                self._send(200, json.dumps(body).encode(), "application/json")
+
+        return Handler
+
+
+class Job:
+    """Один запрос пользователя и его временные отметки."""
+
+    def __init__(self, job_id: int, chat_id: int, kind: str, planned_at: float):
+        self.job_id = job_id
+        self.chat_id = chat_id
+        self.kind = kind
+        # Задержки считаются от планового времени, а не от фактической отправки
+        self.planned_at = planned_at
+        self.sent_at: Optional[float] = None
+        self.first_circle_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.status_message_id: Optional[int] = None
+        self.circles = 0
+        self.status = "pending"
+        self.reply = ""
+        self.done = asyncio.Event()
+
+    def finish(self, status: str, reply: str = "") -> None:
+        if self.done.is_set():
+            return
+        self.finished_at = time.monotonic()
+        self.status = status
+        self.reply = reply
+        self.done.set()
+
+
+class LoadTest:
+    """Генерирует нагрузку и сопоставляет ответы бота с запросами."""
+
+    def __init__(self, args: argparse.Namespace, media: bytes):
+        self.args = args
+        self.loop = asyncio.get_running_loop()
+        self.server = FakeBotAPI(media, self._on_event_threadsafe)
+        # Запросы в работе: message_id сообщения пользователя и статусного сообщения бота -> запрос
+        self.by_message: Dict[int, Job] = {}
+        self.by_status: Dict[int, Job] = {}
+        self.jobs: List[Job] = []
+        self.random = random.Random(args.seed)
+
+    def _on_event_threadsafe(self, method: str, params: Dict, result: Dict) -> None:
+        self.loop.call_soon_threadsafe(self._on_event, method, params, result)
+
+    def _find_job(self, method: str, params: Dict) -> Optional[Job]:
+        """Запрос, к которому относится ответ бота."""
+        if method == "editMessageText":
+            return self.by_status.get(int(params.get("message_id", 0) or 0))
+        reply = params.get("reply_parameters")
+        if isinstance(reply, str):
+            reply = json.loads(reply)
+        if reply:
+            return self.by_message.get(int(reply.get("message_id", 0)))
+        return None
+
+    def _on_event(self, method: str, params: Dict, result: Dict) -> None:
+        job = self._find_job(method, params)
+        if job is None:
+            return
+        text = params.get("text", "")
+
+        if method == "sendVideoNote":
+            job.circles += 1
+            if job.first_circle_at is None:
+                job.first_circle_at = time.monotonic()
+        elif text.startswith("❌") and any(fragment in text for fragment in QUOTA_REPLIES):
+            job.finish("quota", text)
+        elif method == "sendMessage":
+            if text.startswith("❌"):
+                job.finish("error", text)
+            elif job.status_message_id is None:
+                job.status_message_id = result["message_id"]
+                self.by_status[job.status_message_id] = job
+        elif method == "editMessageText":
+            if text.startswith("✅"):
+                job.finish("ok", text)
+            elif text.startswith("❌"):
+                job.finish("error", text)
+
+    async def _wait(self, job: Job, message_id: int) -> None:
+        """Ждёт завершения запроса не дольше job_timeout от планового времени отправки."""
+        try:
+            timeout = max(0.0, job.planned_at + self.args.job_timeout - time.monotonic())
+            await asyncio.wait_for(job.done.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            job.finish("timeout")
+        finally:
+            self.by_message.pop(message_id, None)
+            if job.status_message_id is not None:
+                self.by_status.pop(job.status_message_id, None)
+
+    async def _user(self, chat_id: int, schedule: List[float], started: float) -> None:
+        waits = []
+        for planned in schedule:
+            delay = started + planned - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            kind = "link" if self.random.random() < self.args.link_ratio else "file"
+            job = Job(len(self.jobs), chat_id, kind, started + planned)
+            self.jobs.append(job)
+            job.sent_at = time.monotonic()
+            if kind == "link":
+                message_id = self.server.push_text(chat_id, f"{self.server.url}/media/{job.job_id}.mp4")
+            else:
+                message_id = self.server.push_video(chat_id, f"file{job.job_id}")
+            self.by_message[message_id] = job
+            # Следующий запрос уходит по расписанию, не дожидаясь ответа на этот
+            waits.append(asyncio.create_task(self._wait(job, message_id)))
+
+        await asyncio.gather(*waits)
+
+    async def run(self) -> Dict:
+        import bot
+
+        self.server.start()
+        app = bot.build_application(
+            FAKE_TOKEN,
+            base_url=f"{self.server.url}/bot",
+            base_file_url=f"{self.server.url}/file/bot",
+            concurrent_updates=self.args.concurrent_updates or False,
+            quote_replies=True,
+        )
+
+        # Равномерный поток запросов с заданной суммарной частотой, по кругу между пользователями
+        schedules: Dict[int, List[float]] = {user: [] for user in range(1, self.args.users + 1)}
+        for i in range(self.args.jobs):
+            schedules[i % self.args.users + 1].append(i / self.args.rate)
+
+        async with app:
+            await app.start()
+            await app.updater.start_polling(poll_interval=0.0, timeout=1)
+            started = time.monotonic()
+            await asyncio.gather(*(self._user(chat_id, schedule, started)
+                                   for chat_id, schedule in schedules.items() if schedule))
+            elapsed = time.monotonic() - started
+            await app.updater.stop()
+            await app.stop()
+
+        self.server.stop()
+        return self.report(elapsed)
+
+    def report(self, elapsed: float) -> Dict:
+        ok = [job for job in self.jobs if job.status == "ok"]
+        ttfc = [job.first_circle_at - job.planned_at for job in self.jobs if job.first_circle_at is not None]
+        latency = [job.finished_at - job.planned_at for job in ok]
+        errors: Dict[str, int] = {}
+        for job in self.jobs:
+            if job.status not in ("ok", "quota"):
+                errors[job.status] = errors.get(job.status, 0) + 1
+        rejected = sum(1 for job in self.jobs if job.status == "quota")
+
+        # Частота подачи по окну отправки (без времени на дообработку хвоста)
+        sent = sorted(job.sent_at for job in self.jobs if job.sent_at is not None)
+        offered_rate = (len(sent) - 1) / (sent[-1] - sent[0]) if len(sent) > 1 and sent[-1] > sent[0] else 0.0
+
+        by_kind = {}
+        for kind in ("file", "link"):
+            kind_jobs = [job for job in self.jobs if job.kind == kind]
+            kind_ok = [job for job in kind_jobs if job.status == "ok"]
+            kind_failed = [job for job in kind_jobs if job.status not in ("ok", "quota")]
+            by_kind[kind] = {
+                "jobs": len(kind_jobs),
+                "error_rate": len(kind_failed) / len(kind_jobs) if kind_jobs else 0.0,
+                "latency": percentiles([job.finished_at - job.planned_at for job in kind_ok]),
+            }
+
+        return {
+            "settings": {
+                "users": self.args.users,
+                "jobs": self.args.jobs,
+                "rate": self.args.rate,
+                "link_ratio": self.args.link_ratio,
+                "concurrent_updates": self.args.concurrent_updates,
+                "quotas": self.args.quotas,
+            },
+            "elapsed": elapsed,
+            "offered_rate": offered_rate,
+            "throughput_jobs": len(ok) / elapsed if elapsed else 0.0,
+            "throughput_circles": sum(job.circles for job in self.jobs) / elapsed if elapsed else 0.0,
+            "jobs_total": len(self.jobs),
+            "jobs_ok": len(ok),
+            "error_rate": sum(errors.values()) / len(self.jobs) if self.jobs else 0.0,
+            "errors": errors,
+            "quota_rejections": rejected,
+            "error_samples": sorted({job.reply for job in self.jobs if job.reply and job.status == "error"})[:5],
+            "send_lag": percentiles([job.sent_at - job.planned_at for job in self.jobs if job.sent_at is not None]),
+            "time_to_first_circle": percentiles(ttfc),
+            "job_latency": percentiles(latency),
+            "by_kind": by_kind,
+            "api_requests": dict(self.server.requests),
+            "uploaded_bytes": self.server.uploaded_bytes,
+        }
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """p50/p95/p99 по методу ближайшего ранга."""
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    ordered = sorted(values)
+
+    def rank(p: float) -> float:
+        index = max(0, min(len(ordered) - 1, int(-(-p * len(ordered) // 100)) - 1))
+        return ordered[index]
+
+    return {"p50": rank(50), "p95": rank(95), "p99": rank(99), "max": ordered[-1]}
+
+
+def print_report(report: Dict) -> None:
+    """Выводит сводку нагрузочного теста в человекочитаемом виде."""
+    def fmt(stats: Dict) -> str:
+        if stats["p50"] is None:
+            return "нет данных"
+        return f"p50 {stats['p50']:.2f} с, p95 {stats['p95']:.2f} с, p99 {stats['p99']:.2f} с, max {stats['max']:.2f} с"
+
+    print("=" * 60)
+    print(f"Запросов: {report['jobs_total']}, успешно: {report['jobs_ok']}, "
+          f"доля ошибок: {report['error_rate']:.1%} {report['errors'] or ''}")
+    if report["settings"]["quotas"]:
+        print(f"Отказов по квотам: {report['quota_rejections']}")
+    print(f"Длительность: {report['elapsed']:.1f} с, поданная нагрузка: {report['offered_rate']:.2f} запр/с")
+    print(f"Пропускная способность: {report['throughput_jobs']:.2f} запр/с, "
+          f"{report['throughput_circles']:.2f} кружочков/с")
+    print(f"Задержка отправки от расписания: {fmt(report['send_lag'])}")
+    print(f"Время до первого кружочка: {fmt(report['time_to_first_circle'])}")
+    print(f"Полное время обработки:    {fmt(report['job_latency'])}")
+    for kind, stats in report["by_kind"].items():
+        if stats["jobs"]:
+            print(f"  {kind}: {stats['jobs']} запр., ошибок {stats['error_rate']:.1%}, {fmt(stats['latency'])}")
+    for sample in report["error_samples"]:
+        print(f"  пример ошибки: {sample.splitlines()[0]}")
+    print("=" * 60)
+
+
+def load_media(path: Optional[str]) -> bytes:
+    """Читает тестовое видео или генерирует его через lavfi (как в benchmark.py)."""
+    if path:
+        return Path(path).read_bytes()
+    import benchmark
+    cfg = next(c for c in benchmark.BENCH_CONFIGS if c["name"] == "square_360p_short")
+    return benchmark.generate_source(cfg).read_bytes()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с заглушкой Telegram Bot API")
+    parser.add_argument("--users", type=int, default=10, help="Количество пользователей")
+    parser.add_argument("--jobs", type=int, default=30, help="Общее количество запросов")
+    parser.add_argument("--rate", type=float, default=1.0, help="Суммарная частота запросов (в секунду)")
+    parser.add_argument("--link-ratio", type=float, default=0.5, help="Доля запросов со ссылкой вместо файла")
+    parser.add_argument("--concurrent-updates", type=int, default=0,
+                        help="Параллельная обработка обновлений в боте (0 - последовательно)")
+    parser.add_argument("--quotas", action="store_true",
+                        help="Не отключать квоты на пользователя (отказы считаются отдельно от ошибок)")
+    parser.add_argument("--job-timeout", type=float, default=300.0, help="Таймаут одного запроса (с)")
+    parser.add_argument("--media", help="Видео для отправки (по умолчанию синтетическое через lavfi)")
+    parser.add_argument("--seed", type=int, default=1, help="Зерно генератора случайных чисел")
+    parser.add_argument("-o", "--output", help="Сохранить отчёт в JSON")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Показывать логи бота")
+    args = parser.parse_args()
+
+    # Трафик к заглушке не должен уходить в прокси
+    os.environ["NO_PROXY"] = ",".join(filter(None, [os.environ.get("NO_PROXY"), "127.0.0.1", "localhost"]))
+
+    media = load_media(args.media)
+
+    if not args.quotas:
+        # Несколько пользователей быстро исчерпали бы квоты, и тест мерил бы отказы
+        import config
+        config.QUOTA_MAX_CPU_SECONDS = None
+        config.QUOTA_MAX_DOWNLOAD_BYTES = None
+        config.QUOTA_MAX_CIRCLES = None
+
+    import bot  # noqa: F401  (настраивает логирование при импорте)
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    async def run() -> Dict:
+        return await LoadTest(args, media).run()
+
+    report = asyncio.run(run())
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Отчёт сохранён в {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""Учёт ресурсов и квоты на одного пользователя (чат)"""
+
+import logging
+import math
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# История использования по чатам: (время, скачано байт, CPU-секунды, кружочков)
+_usage: Dict[int, Deque[Tuple[float, int, float, int]]] = defaultdict(deque)
+
+# Резервы заданий, которые прошли проверку, но ещё не завершились (по чатам).
+# Без них несколько одновременных заданий одного чата проходили бы проверку по
+# одному и тому же ещё не списанному использованию.
+_pending: Dict[int, List[Dict]] = defaultdict(list)
+
+
+class QuotaExceeded(Exception):
+    """Запрос превышает ограничения; текст исключения можно показать пользователю."""
+
+
+def _prune(chat_id: int, now: float) -> Deque[Tuple[float, int, float, int]]:
+    """Удаляет записи старше окна квот и возвращает оставшиеся."""
+    history = _usage[chat_id]
+    while history and now - history[0][0] > config.QUOTA_WINDOW:
+        history.popleft()
+    return history
+
+
+def record_usage(chat_id: int, download_bytes: int = 0, cpu_seconds: float = 0.0, circles: int = 0) -> None:
+    """Записывает израсходованные чатом ресурсы."""
+    _prune(chat_id, time.time()).append((time.time(), download_bytes, cpu_seconds, circles))
+
+
+def get_usage(chat_id: int) -> Dict:
+    """Сколько ресурсов чат израсходовал за текущее окно квот."""
+    history = _prune(chat_id, time.time())
+    return {
+        "download_bytes": sum(entry[1] for entry in history),
+        "cpu_seconds": sum(entry[2] for entry in history),
+        "circles": sum(entry[3] for entry in history),
+        "requests": len(history),
+    }
+
+
+def _pending_usage(chat_id: int) -> Dict:
+    """Сколько зарезервировано под незавершённые задания чата."""
+    pending = _pending.get(chat_id) or []
+    return {
+        "download_bytes": sum(r["download_bytes"] for r in pending),
+        "circles": sum(r["circles"] for r in pending),
+    }
+
+
+def release(reservation: Optional[Dict]) -> None:
+    """Снимает резерв, выданный check_request (повторный вызов ничего не делает)."""
+    if not reservation:
+        return
+    pending = _pending.get(reservation["chat_id"])
+    if pending:
+        pending[:] = [r for r in pending if r is not reservation]
+        if not pending:
+            del _pending[reservation["chat_id"]]
+
+
+def _format_wait(chat_id: int) -> str:
+    """Через сколько освободится самая старая запись окна (для текста ответа)."""
+    history = _usage.get(chat_id)
+    if not history:
+        return ""
+    wait = max(0, int(config.QUOTA_WINDOW - (time.time() - history[0][0])))
+    return f" Попробуй через {max(1, math.ceil(wait / 60))} мин."
+
+
+def _check_request_limits(duration: Optional[float], circles: int) -> None:
+    """Ограничения на один запрос: длительность исходника и число кружочков."""
+    if duration and config.MAX_SOURCE_DURATION and duration > config.MAX_SOURCE_DURATION:
+        raise QuotaExceeded(
+            f"Видео слишком длинное ({duration / 60:.1f} мин). "
+            f"Максимум - {config.MAX_SOURCE_DURATION / 60:.0f} мин."
+        )
+
+    if circles and config.MAX_CIRCLES_PER_REQUEST and circles > config.MAX_CIRCLES_PER_REQUEST:
+        raise QuotaExceeded(
+            f"Из этого видео получится {circles} кружочков, а за один раз можно не больше "
+            f"{config.MAX_CIRCLES_PER_REQUEST}. Отправь видео покороче."
+        )
+
+
+def check_request(chat_id: int, duration: Optional[float] = None, download_bytes: Optional[int] = None,
+                  segment_duration: int = config.DEFAULT_SEGMENT_DURATION) -> Dict:
+    """
+    Проверяет ограничения до начала скачивания и резервирует оценку задания.
+
+    Резерв (размер и число кружочков) учитывается при проверке следующих
+    запросов того же чата, пока его не снимет account_job (или release).
+
+    Args:
+        chat_id: Идентификатор чата
+        duration: Длительность исходника в секундах (если известна)
+        download_bytes: Размер исходника в байтах (если известен)
+        segment_duration: Длительность отрезка (для оценки числа кружочков)
+
+    Returns:
+        Резерв; его нужно положить в запись задания под ключом "reservation"
+
+    Raises:
+        QuotaExceeded: Если запрос или накопленное использование превышает лимиты
+    """
+    circles = math.ceil(duration / segment_duration) if duration else 0
+    _check_request_limits(duration, circles)
+
+    usage = get_usage(chat_id)
+    pending = _pending_usage(chat_id)
+    window_hours = config.QUOTA_WINDOW / 3600
+
+    if config.QUOTA_MAX_CPU_SECONDS and usage["cpu_seconds"] >= config.QUOTA_MAX_CPU_SECONDS:
+        raise QuotaExceeded(
+            f"Лимит обработки исчерпан ({config.QUOTA_MAX_CPU_SECONDS / 60:.0f} мин. процессорного "
+            f"времени за {window_hours:g} ч).{_format_wait(chat_id)}"
+        )
+
+    downloaded = usage["download_bytes"] + pending["download_bytes"]
+    if config.QUOTA_MAX_DOWNLOAD_BYTES and downloaded + (download_bytes or 0) > config.QUOTA_MAX_DOWNLOAD_BYTES:
+        raise QuotaExceeded(
+            f"Лимит скачивания исчерпан ({config.QUOTA_MAX_DOWNLOAD_BYTES / (1024 * 1024):.0f} МБ "
+            f"за {window_hours:g} ч).{_format_wait(chat_id)}"
+        )
+
+    if config.QUOTA_MAX_CIRCLES and usage["circles"] + pending["circles"] + circles > config.QUOTA_MAX_CIRCLES:
+        raise QuotaExceeded(
+            f"Лимит кружочков исчерпан ({config.QUOTA_MAX_CIRCLES} за {window_hours:g} ч).{_format_wait(chat_id)}"
+        )
+
+    reservation = {"chat_id": chat_id, "download_bytes": download_bytes or 0, "circles": circles}
+    _pending[chat_id].append(reservation)
+    return reservation
+
+
+def check_planned(reservation: Dict, duration: Optional[float], circles: int) -> None:
+    """
+    Проверяет ограничения ещё раз, когда исходник скачан и нарезка спланирована.
+
+    У документов и прямых ссылок длительность до скачивания часто неизвестна,
+    и check_request пропускает ограничения на запрос. Здесь они проверяются по
+    фактической длительности и числу отрезков - до кодирования, - а резерв
+    кружочков заменяется точным значением.
+
+    Args:
+        reservation: Резерв, выданный check_request
+        duration: Длительность исходника в секундах
+        circles: Сколько кружочков получится
+
+    Raises:
+        QuotaExceeded: Если запрос превышает лимиты
+    """
+    _check_request_limits(duration, circles)
+
+    chat_id = reservation["chat_id"]
+    extra = circles - reservation["circles"]
+    if config.QUOTA_MAX_CIRCLES and extra > 0:
+        used = get_usage(chat_id)["circles"] + _pending_usage(chat_id)["circles"]
+        if used + extra > config.QUOTA_MAX_CIRCLES:
+            raise QuotaExceeded(
+                f"Лимит кружочков исчерпан ({config.QUOTA_MAX_CIRCLES} за "
+                f"{config.QUOTA_WINDOW / 3600:g} ч).{_format_wait(chat_id)}"
+            )
+    reservation["circles"] = circles
+
+
+@contextmanager
+def account_job(chat_id: int, job: Dict) -> Iterator[None]:
+    """
+    По завершении задания (в том числе с ошибкой) списывает с чата израсходованное.
+
+    Берёт download_bytes, cpu_seconds и circles из записи задания
+    (encoding_profiles.track_job), которые заполняет video_processor, и снимает
+    резерв из job["reservation"] (см. check_request): вместо оценки теперь
+    учитывается фактическое использование.
+    """
+    try:
+        yield
+    finally:
+        release(job.get("reservation"))
+        record_usage(
+            chat_id,
+            download_bytes=job.get("download_bytes", 0),
+            cpu_seconds=job.get("cpu_seconds", 0.0),
+            circles=job.get("circles", 0),
+        )
+        logger.info(
+            f"Использование чата {chat_id}: скачано {job.get('download_bytes', 0)} байт, "
+            f"CPU {job.get('cpu_seconds', 0.0):.1f} с, кружочков {job.get('circles', 0)}"
+        )
@@ -0,0 +1,165 @@
+"""Размещение готовых кружочков в памяти (tmpfs) вместо диска.
+
+Кружочки живут секунды: ffmpeg пишет файл, бот его отправляет и удаляет.
+Если есть tmpfs (по умолчанию /dev/shm), такие файлы пишутся туда и не
+трогают диск. Общий объём ограничен config.SEGMENT_MEMORY_BUDGET; когда
+бюджет исчерпан, используется обычная папка на диске.
+
+Учёт ведётся по фактическому размеру файлов в папке (общий для всех
+процессов) плюс резерв под отрезки, которые кодируются прямо сейчас.
+Бюджет не может превысить реально свободное место: /dev/shm в Docker
+по умолчанию всего 64 МБ и делится с другими программами.
+Отдельно освобождать память не нужно: достаточно удалить файл. Файлы
+завершившихся процессов удаляются при старте бота и когда бюджет исчерпан.
+"""
+
+import logging
+import os
+import re
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Резерв на один отрезок: сам файл и копия после optimize_video_size
+SEGMENT_RESERVATION = 2 * config.MAX_FILE_SIZE
+
+# Зарезервировано под отрезки, которые сейчас кодируются в этом процессе
+_reserved = 0
+
+# В именах кружочков в памяти есть pid создавшего процесса:
+# <prefix>_<pid>_<8 hex>_<номер>.mp4 (см. video_processor.cut_video_to_circles)
+_OWNER_PID = re.compile(r'_(\d+)_[0-9a-f]{8}_\d+')
+
+
+def memory_dir() -> Optional[Path]:
+    """Папка в памяти для кружочков или None, если tmpfs недоступен или отключён."""
+    if not config.SEGMENT_MEMORY_DIR or config.SEGMENT_MEMORY_BUDGET <= 0:
+        return None
+    base = Path(config.SEGMENT_MEMORY_DIR)
+    if not base.is_dir():
+        return None
+    path = base / "circul_segments"
+    try:
+        path.mkdir(exist_ok=True)
+    except OSError:
+        return None
+    return path if os.access(path, os.W_OK) else None
+
+
+def memory_usage(path: Path) -> int:
+    """Суммарный размер файлов в папке (байты)."""
+    total = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    total += entry.stat().st_size
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return total
+
+
+def free_space(path: Path) -> Optional[int]:
+    """Свободное место в файловой системе папки (байты) или None, если узнать нельзя."""
+    try:
+        stat = os.statvfs(path)
+    except (AttributeError, OSError):
+        # os.statvfs нет в Windows
+        return None
+    return stat.f_bavail * stat.f_frsize
+
+
+def _fits(path: Path) -> bool:
+    """Помещается ли ещё один отрезок в бюджет памяти и в свободное место tmpfs."""
+    needed = _reserved + SEGMENT_RESERVATION
+    if memory_usage(path) + needed > config.SEGMENT_MEMORY_BUDGET:
+        return False
+    # Зарезервированные отрезки ещё не записаны, поэтому свободное место их не учитывает
+    free = free_space(path)
+    return free is None or needed <= free
+
+
+@contextmanager
+def reserve(fallback_dir: Path) -> Iterator[Path]:
+    """
+    Выбирает папку для одного отрезка: в памяти, если хватает бюджета, иначе fallback_dir.
+
+    Пока контекст открыт, под отрезок держится резерв SEGMENT_RESERVATION;
+    после выхода объём учитывается по реальному размеру файла.
+
+    Yields:
+        Папка, в которую нужно записать отрезок
+    """
+    global _reserved
+    path = memory_dir()
+    if path is not None and not _fits(path):
+        # Бюджет могут занимать файлы упавших процессов: убираем их и проверяем ещё раз
+        cleanup_stale()
+    if path is None or not _fits(path):
+        yield fallback_dir
+        return
+
+    _reserved += SEGMENT_RESERVATION
+    try:
+        yield path
+    finally:
+        _reserved -= SEGMENT_RESERVATION
+
+
+def is_in_memory(file_path: str) -> bool:
+    """Лежит ли файл в папке для кружочков в памяти."""
+    path = memory_dir()
+    return path is not None and Path(file_path).parent == path
+
+
+def _process_alive(pid: int) -> bool:
+    """Жив ли процесс с таким pid (при сомнениях считаем, что жив)."""
+    if pid == os.getpid():
+        return True
+    if os.name == 'nt':
+        # В Windows os.kill(pid, 0) - не проверка, а отправка CTRL_C_EVENT
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Например, PermissionError: процесс есть, но чужой
+        return True
+    return True
+
+
+def cleanup_stale(max_age: float = 3600) -> int:
+    """
+    Удаляет забытые файлы, иначе они занимают память до перезагрузки.
+
+    Файл забыт, если создавший его процесс (pid в имени) уже завершился -
+    например, упал, - или если файл старше max_age секунд.
+
+    Returns:
+        Количество удалённых файлов
+    """
+    path = memory_dir()
+    if path is None:
+        return 0
+    removed = 0
+    now = time.time()
+    for entry in path.iterdir():
+        try:
+            owner = _OWNER_PID.search(entry.name)
+            orphaned = owner is not None and not _process_alive(int(owner.group(1)))
+            if orphaned or now - entry.stat().st_mtime > max_age:
+                entry.unlink()
+                removed += 1
+        except OSError:
+            continue
+    if removed:
+        logger.info(f"Удалено {removed} забытых кружочков из {path}")
+    return removed
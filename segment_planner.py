@@ -0,0 +1,198 @@
+"""Выбор границ отрезков по сменам сцен и паузам в звуке.
+
+Анализ делается одним дешёвым проходом FFmpeg (кадры прореживаются и
+уменьшаются, звук передискретизируется): select собирает оценки смены сцены,
+silencedetect - интервалы тишины. Здесь только построение команды, разбор её
+вывода и выбор точек разреза; запуск и кеширование - в video_processor.
+"""
+
+import re
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Tuple
+
+import config
+
+# Частота и ширина кадров для анализа сцен (точности хватает, декодирование дешевле)
+ANALYSIS_FPS = 5
+ANALYSIS_WIDTH = 160
+
+# Оценки смены сцены ниже порога не сохраняем
+SCENE_SCORE_THRESHOLD = 0.1
+
+# Параметры поиска тишины
+SILENCE_NOISE_DB = -35
+SILENCE_MIN_DURATION = 0.3
+
+# Веса при выборе точки разреза
+SCENE_WEIGHT = 1.0
+SILENCE_WEIGHT = 1.0
+KEYFRAME_WEIGHT = 0.5
+DISTANCE_WEIGHT = 1.0
+
+# Насколько далеко можно сдвинуть разрез к ключевому кадру (секунды)
+KEYFRAME_SNAP = 0.5
+
+
+def analysis_command(ffmpeg_cmd: str, video_path: str) -> List[str]:
+    """Команда FFmpeg для одного прохода анализа (результат и CPU-время - в stderr)."""
+    return [
+        ffmpeg_cmd, '-hide_banner', '-nostats',
+        '-benchmark',  # CPU-время прохода списывается с квоты (см. video_processor._record_cpu_time)
+        '-i', video_path,
+        '-map', '0:v:0', '-map', '0:a:0?',
+        '-filter:v', f"fps={ANALYSIS_FPS},scale={ANALYSIS_WIDTH}:-2,"
+                     f"select='gte(scene,0)',metadata=print:key=lavfi.scene_score",
+        '-filter:a', f"aresample=8000,silencedetect=noise={SILENCE_NOISE_DB}dB:d={SILENCE_MIN_DURATION}",
+        '-f', 'null', '-'
+    ]
+
+
+def parse_analysis_output(output: str) -> Dict:
+    """
+    Разбирает stderr прохода анализа.
+
+    Returns:
+        {"scenes": [[время, оценка], ...], "silences": [[начало, конец|None], ...]}
+    """
+    scenes = []
+    silences = []
+    last_pts = None
+    silence_start = None
+
+    for line in output.splitlines():
+        pts_match = re.search(r'pts_time:(-?[\d.]+)', line)
+        if pts_match:
+            last_pts = float(pts_match.group(1))
+            continue
+        score_match = re.search(r'lavfi\.scene_score=([\d.]+)', line)
+        if score_match and last_pts is not None:
+            score = float(score_match.group(1))
+            if score >= SCENE_SCORE_THRESHOLD:
+                scenes.append([last_pts, score])
+            continue
+        start_match = re.search(r'silence_start: (-?[\d.]+)', line)
+        if start_match:
+            silence_start = max(0.0, float(start_match.group(1)))
+            continue
+        end_match = re.search(r'silence_end: (-?[\d.]+)', line)
+        if end_match:
+            silences.append([silence_start or 0.0, float(end_match.group(1))])
+            silence_start = None
+
+    if silence_start is not None:
+        # Тишина до конца файла
+        silences.append([silence_start, None])
+
+    return {"scenes": scenes, "silences": silences}
+
+
+def _between(values: List[float], low: float, high: float) -> List[float]:
+    """Значения отсортированного списка в отрезке [low, high]."""
+    return values[bisect_left(values, low):bisect_right(values, high)]
+
+
+def _nearest(values: List[float], t: float) -> Optional[float]:
+    """Ближайшее к t значение отсортированного списка (None для пустого списка)."""
+    i = bisect_left(values, t)
+    return min(values[max(0, i - 1):i + 1], key=lambda v: abs(v - t), default=None)
+
+
+def _build_index(analysis: Dict, keyframes: List[float], duration: float) -> Dict:
+    """
+    Сортированные списки для поиска через bisect: на каждый отрезок смотрим
+    только точки рядом с его окном, а не все точки видео.
+    """
+    scenes = sorted(analysis["scenes"])
+    silences = sorted((start, end if end is not None else duration) for start, end in analysis["silences"])
+    return {
+        "scene_times": [time_ for time_, _ in scenes],
+        "scene_scores": [score for _, score in scenes],
+        "silence_starts": [start for start, _ in silences],
+        "silence_ends": [end for _, end in silences],
+        "silence_points": sorted(
+            point for start, end in silences for point in (start, end, (start + end) / 2)
+        ),
+        "keyframes": sorted(keyframes),
+    }
+
+
+def _score_cut(t: float, target: float, segment_duration: float, index: Dict) -> float:
+    """Оценка точки разреза: больше - лучше."""
+    score = -DISTANCE_WEIGHT * abs(t - target) / segment_duration
+
+    times = index["scene_times"]
+    first = bisect_left(times, t - 1.0 / ANALYSIS_FPS)
+    last = bisect_right(times, t + 1.0 / ANALYSIS_FPS)
+    if first < last:
+        score += SCENE_WEIGHT * max(index["scene_scores"][first:last])
+
+    # Интервалы тишины не пересекаются: достаточно проверить последний начавшийся до t
+    i = bisect_right(index["silence_starts"], t) - 1
+    if i >= 0 and t <= index["silence_ends"][i]:
+        score += SILENCE_WEIGHT
+
+    nearest = _nearest(index["keyframes"], t)
+    if nearest is not None and abs(nearest - t) < 0.05:
+        score += KEYFRAME_WEIGHT
+
+    return score
+
+
+def plan_segments(duration: float, segment_duration: int, analysis: Dict,
+                  keyframes: Optional[List[float]] = None) -> List[Tuple[float, float, bool]]:
+    """
+    Выбирает границы отрезков в пределах MIN_SEGMENT_DURATION..MAX_SEGMENT_DURATION,
+    предпочитая смены сцен, паузы и ключевые кадры (на них дешёвый seek).
+
+    Время работы линейно по длительности видео: для каждого отрезка
+    рассматриваются только точки в окне вокруг него.
+
+    Returns:
+        Список (начало, длительность, начинается_с_ключевого_кадра) - в том же
+        формате, что и video_processor.plan_segments
+    """
+    index = _build_index(analysis, keyframes or [], duration)
+    keyframes = index["keyframes"]
+    pieces = []
+    start_time = 0.0
+
+    while start_time < duration:
+        remaining = duration - start_time
+        # Пропускаем слишком короткие отрезки (< 1 секунды)
+        if remaining < 1.0:
+            break
+
+        if remaining <= config.MAX_SEGMENT_DURATION:
+            end_time = duration
+        else:
+            low = start_time + config.MIN_SEGMENT_DURATION
+            # Не оставляем в конце хвост короче минимальной длительности
+            high = min(start_time + config.MAX_SEGMENT_DURATION, duration - config.MIN_SEGMENT_DURATION)
+            target = min(max(start_time + segment_duration, low), high)
+
+            # Кандидаты дальше KEYFRAME_SNAP от окна не попадут в него даже после сдвига
+            near_low, near_high = low - KEYFRAME_SNAP, high + KEYFRAME_SNAP
+            candidates = {target}
+            candidates.update(_between(index["scene_times"], near_low, near_high))
+            candidates.update(_between(index["silence_points"], near_low, near_high))
+            # Каждого кандидата пробуем и в варианте, сдвинутом на ближайший ключевой кадр
+            for t in list(candidates):
+                nearest = _nearest(keyframes, t)
+                if nearest is not None and abs(nearest - t) <= KEYFRAME_SNAP:
+                    candidates.add(nearest)
+            candidates.update(_between(keyframes, low, high))
+
+            window = [t for t in candidates if low <= t <= high]
+            end_time = max(
+                window or [target],
+                key=lambda t: _score_cut(t, target, segment_duration, index)
+            )
+
+        nearest = _nearest(keyframes, start_time)
+        on_keyframe = bool(keyframes) and (
+            start_time == 0.0 or (nearest is not None and abs(nearest - start_time) < 0.001)
+        )
+        pieces.append((start_time, end_time - start_time, on_keyframe))
+        start_time = end_time
+
+    return pieces
@@ -0,0 +1,84 @@
+"""Тесты выбора профиля кодирования по нагрузке."""
+
+import pytest
+
+import config
+import encoding_profiles
+
+PROFILES = [
+    {"name": "quality", "preset": "medium", "crf": 21, "size": 640, "max_queue": 1, "max_cpu": 0.5},
+    {"name": "balanced", "preset": "fast", "crf": 23, "size": 640, "max_queue": 4, "max_cpu": 0.85},
+    {"name": "fast", "preset": "veryfast", "crf": 25, "size": 512, "max_queue": 12, "max_cpu": 1.5},
+    {"name": "burst", "preset": "ultrafast", "crf": 27, "size": 384, "max_queue": None, "max_cpu": None},
+]
+
+
+@pytest.fixture(autouse=True)
+def profiles(monkeypatch):
+    monkeypatch.setattr(config, "ADAPTIVE_ENCODING", True)
+    monkeypatch.setattr(config, "ENCODING_PROFILES", PROFILES)
+    monkeypatch.setattr(encoding_profiles, "_queue_depth_provider", None)
+
+
+@pytest.mark.parametrize("queue_depth, cpu, expected", [
+    (0, 0.0, "quality"),
+    (1, 0.5, "quality"),
+    (2, 0.0, "balanced"),
+    (1, 0.6, "balanced"),
+    (4, 0.85, "balanced"),
+    (5, 0.1, "fast"),
+    (1, 1.2, "fast"),
+    (12, 1.5, "fast"),
+    (13, 0.0, "burst"),
+    (0, 3.0, "burst"),
+])
+def test_select_profile_by_load(queue_depth, cpu, expected):
+    profile = encoding_profiles.select_profile({"queue_depth": queue_depth, "cpu": cpu})
+    assert profile["name"] == expected
+    source = next(p for p in PROFILES if p["name"] == expected)
+    assert {key: profile[key] for key in ("preset", "crf", "size")} == \
+        {key: source[key] for key in ("preset", "crf", "size")}
+    assert profile["queue_depth"] == queue_depth
+
+
+def test_select_profile_without_free_tier(monkeypatch):
+    # Если ни один профиль не подходит, берётся последний (самый быстрый)
+    monkeypatch.setattr(config, "ENCODING_PROFILES", PROFILES[:2])
+    assert encoding_profiles.select_profile({"queue_depth": 50, "cpu": 5.0})["name"] == "balanced"
+
+
+@pytest.mark.parametrize("adaptive, profiles", [(False, PROFILES), (True, [])])
+def test_select_profile_static(monkeypatch, adaptive, profiles):
+    monkeypatch.setattr(config, "ADAPTIVE_ENCODING", adaptive)
+    monkeypatch.setattr(config, "ENCODING_PROFILES", profiles)
+    profile = encoding_profiles.select_profile({"queue_depth": 100, "cpu": 10.0})
+    assert profile == encoding_profiles.static_profile()
+
+
+def test_queue_depth_provider(monkeypatch):
+    monkeypatch.setattr(encoding_profiles, "_active_jobs", 0)
+    encoding_profiles.set_queue_depth_provider(lambda: 6)
+    assert encoding_profiles.current_load()["queue_depth"] == 6
+    with encoding_profiles.track_job():
+        encoding_profiles.set_queue_depth_provider(lambda: 0)
+        assert encoding_profiles.current_load()["queue_depth"] == 1
+
+
+@pytest.mark.parametrize("width, height, mode, expected_size, native", [
+    (None, None, "crop", 640, False),
+    (1920, 1080, "crop", 640, False),
+    (640, 640, "crop", 640, False),
+    (480, 360, "crop", 360, True),
+    (480, 360, "pad", 480, True),
+    (1280, 360, "pad", 640, False),
+    # libx264 требует чётный размер
+    (481, 481, "crop", 480, True),
+    (0, 100, "crop", 640, False),
+])
+def test_fit_profile_to_source(width, height, mode, expected_size, native):
+    profile = {"name": "quality", "preset": "medium", "crf": 21, "size": 640}
+    fitted = encoding_profiles.fit_profile_to_source(profile, width, height, mode)
+    assert fitted["size"] == expected_size
+    assert fitted.get("native", False) is native
+    assert {key: fitted[key] for key in ("name", "preset", "crf")} == {"name": "quality", "preset": "medium", "crf": 21}
+    assert profile["size"] == 640
@@ -0,0 +1,181 @@
+"""Тесты ограничений на запрос и квот на пользователя."""
+
+import math
+
+import pytest
+
+import config
+import quotas
+
+
+class FakeClock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture(autouse=True)
+def clean_usage(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(quotas, "time", clock)
+    quotas._usage.clear()
+    quotas._pending.clear()
+    yield clock
+    quotas._usage.clear()
+    quotas._pending.clear()
+
+
+def test_default_limits_are_consistent():
+    # Видео максимальной длительности не должно упираться в лимит кружочков на запрос
+    circles = math.ceil(config.MAX_SOURCE_DURATION / config.DEFAULT_SEGMENT_DURATION)
+    assert circles <= config.MAX_CIRCLES_PER_REQUEST
+    assert config.MAX_CIRCLES_PER_REQUEST <= config.QUOTA_MAX_CIRCLES
+    quotas.check_request(1, duration=config.MAX_SOURCE_DURATION)
+
+
+@pytest.mark.parametrize("limits, kwargs, message", [
+    ({}, {"duration": 31 * 60}, "слишком длинное"),
+    ({"MAX_CIRCLES_PER_REQUEST": 5}, {"duration": 51}, "получится 6 кружочков"),
+    ({"MAX_CIRCLES_PER_REQUEST": 5}, {"duration": 50}, None),
+    ({"MAX_CIRCLES_PER_REQUEST": 5}, {"duration": 100, "segment_duration": 20}, None),
+    ({"QUOTA_MAX_DOWNLOAD_BYTES": 100}, {"download_bytes": 101}, "Лимит скачивания"),
+    ({"QUOTA_MAX_DOWNLOAD_BYTES": 100}, {"download_bytes": 100}, None),
+    ({"QUOTA_MAX_CIRCLES": 3}, {"duration": 31}, "Лимит кружочков"),
+    # None отключает ограничение
+    ({"MAX_SOURCE_DURATION": None, "MAX_CIRCLES_PER_REQUEST": None, "QUOTA_MAX_CIRCLES": None},
+     {"duration": 10 * 3600}, None),
+    # Неизвестные длительность и размер не мешают запросу
+    ({}, {}, None),
+])
+def test_check_request_limits(monkeypatch, limits, kwargs, message):
+    for name, value in limits.items():
+        monkeypatch.setattr(config, name, value)
+    if message is None:
+        quotas.check_request(1, **kwargs)
+    else:
+        with pytest.raises(quotas.QuotaExceeded, match=message):
+            quotas.check_request(1, **kwargs)
+
+
+@pytest.mark.parametrize("usage, kwargs, message", [
+    ({"cpu_seconds": config.QUOTA_MAX_CPU_SECONDS}, {}, "Лимит обработки"),
+    ({"cpu_seconds": config.QUOTA_MAX_CPU_SECONDS - 1}, {}, None),
+    ({"download_bytes": config.QUOTA_MAX_DOWNLOAD_BYTES - 10}, {"download_bytes": 11}, "Лимит скачивания"),
+    ({"circles": config.QUOTA_MAX_CIRCLES - 1}, {"duration": 20}, "Лимит кружочков"),
+    ({"circles": config.QUOTA_MAX_CIRCLES - 2}, {"duration": 20}, None),
+])
+def test_check_request_accumulated_usage(usage, kwargs, message):
+    quotas.record_usage(1, **usage)
+    if message is None:
+        quotas.check_request(1, **kwargs)
+    else:
+        with pytest.raises(quotas.QuotaExceeded, match=message):
+            quotas.check_request(1, **kwargs)
+    # Квоты у каждого чата свои
+    quotas.check_request(2, **kwargs)
+
+
+def test_usage_expires_after_window(clean_usage):
+    quotas.record_usage(1, cpu_seconds=config.QUOTA_MAX_CPU_SECONDS)
+    with pytest.raises(quotas.QuotaExceeded, match="Попробуй через 60 мин"):
+        quotas.check_request(1)
+
+    clean_usage.now += config.QUOTA_WINDOW + 1
+    quotas.check_request(1)
+    assert quotas.get_usage(1) == {"download_bytes": 0, "cpu_seconds": 0, "circles": 0, "requests": 0}
+
+
+def test_account_job_records_usage():
+    job = {"download_bytes": 1000, "cpu_seconds": 2.5, "circles": 3}
+    with quotas.account_job(1, job):
+        pass
+    assert quotas.get_usage(1) == {"download_bytes": 1000, "cpu_seconds": 2.5, "circles": 3, "requests": 1}
+
+
+def test_account_job_records_usage_on_error():
+    job = {}
+    with pytest.raises(RuntimeError):
+        with quotas.account_job(1, job):
+            job["cpu_seconds"] = 4.0
+            raise RuntimeError("ffmpeg упал")
+    assert quotas.get_usage(1)["cpu_seconds"] == 4.0
+    assert quotas.get_usage(1)["requests"] == 1
+
+
+@pytest.mark.parametrize("limits, first, second, message", [
+    ({"QUOTA_MAX_CIRCLES": 3}, {"duration": 20}, {"duration": 20}, "Лимит кружочков"),
+    ({"QUOTA_MAX_CIRCLES": 4}, {"duration": 20}, {"duration": 20}, None),
+    ({"QUOTA_MAX_DOWNLOAD_BYTES": 100}, {"download_bytes": 60}, {"download_bytes": 60}, "Лимит скачивания"),
+    ({"QUOTA_MAX_DOWNLOAD_BYTES": 100}, {"download_bytes": 50}, {"download_bytes": 50}, None),
+])
+def test_concurrent_requests_see_reservations(monkeypatch, limits, first, second, message):
+    for name, value in limits.items():
+        monkeypatch.setattr(config, name, value)
+    quotas.check_request(1, **first)
+    if message is None:
+        quotas.check_request(1, **second)
+    else:
+        with pytest.raises(quotas.QuotaExceeded, match=message):
+            quotas.check_request(1, **second)
+    # Резерв одного чата не мешает другому
+    quotas.check_request(2, **second)
+
+
+def test_account_job_settles_reservation(monkeypatch):
+    monkeypatch.setattr(config, "QUOTA_MAX_CIRCLES", 3)
+    job = {"reservation": quotas.check_request(1, duration=30)}
+    with pytest.raises(quotas.QuotaExceeded):
+        quotas.check_request(1, duration=10)
+
+    # Фактически получился один кружочек: резерв снят, списано реальное использование
+    with quotas.account_job(1, job):
+        job["circles"] = 1
+    assert quotas._pending_usage(1) == {"download_bytes": 0, "circles": 0}
+    assert quotas.get_usage(1)["circles"] == 1
+    quotas.check_request(1, duration=20)
+
+
+def test_release_is_idempotent():
+    reservation = quotas.check_request(1, duration=20, download_bytes=10)
+    other = quotas.check_request(1, duration=10)
+    quotas.release(reservation)
+    quotas.release(reservation)
+    quotas.release(None)
+    assert quotas._pending_usage(1) == {"download_bytes": 0, "circles": 1}
+    quotas.release(other)
+    assert quotas._pending_usage(1) == {"download_bytes": 0, "circles": 0}
+
+
+@pytest.mark.parametrize("limits, duration, circles, message", [
+    # Длительность документа стала известна только после скачивания
+    ({}, 31 * 60, 186, "слишком длинное"),
+    ({"MAX_CIRCLES_PER_REQUEST": 5}, 60, 6, "получится 6 кружочков"),
+    ({"MAX_CIRCLES_PER_REQUEST": 5}, 60, 5, None),
+    ({"QUOTA_MAX_CIRCLES": 3}, 40, 4, "Лимит кружочков"),
+    ({"QUOTA_MAX_CIRCLES": 3}, 30, 3, None),
+])
+def test_check_planned_limits(monkeypatch, limits, duration, circles, message):
+    for name, value in limits.items():
+        monkeypatch.setattr(config, name, value)
+    reservation = quotas.check_request(1, download_bytes=10)
+    if message is None:
+        quotas.check_planned(reservation, duration, circles)
+        assert quotas._pending_usage(1)["circles"] == circles
+    else:
+        with pytest.raises(quotas.QuotaExceeded, match=message):
+            quotas.check_planned(reservation, duration, circles)
+
+
+def test_check_planned_counts_own_reservation(monkeypatch):
+    monkeypatch.setattr(config, "QUOTA_MAX_CIRCLES", 4)
+    reservation = quotas.check_request(1, duration=30)
+    other = quotas.check_request(1, duration=10)
+    # Своя оценка (3) уже в резерве: проверяется только прирост
+    quotas.check_planned(reservation, 30, 3)
+    with pytest.raises(quotas.QuotaExceeded, match="Лимит кружочков"):
+        quotas.check_planned(reservation, 35, 4)
+    quotas.release(other)
+    quotas.check_planned(reservation, 35, 4)
+    assert quotas._pending_usage(1)["circles"] == 4
@@ -0,0 +1,105 @@
+"""Тесты разбора прохода анализа и выбора границ отрезков."""
+
+import pytest
+
+import segment_planner
+import video_processor
+
+
+def rounded(pieces):
+    return [(round(start, 3), round(length, 3), on_keyframe) for start, length, on_keyframe in pieces]
+
+
+ANALYSIS_OUTPUT = """\
+[Parsed_metadata_4 @ 0x5581] lavfi.scene_score=0.900000
+[Parsed_metadata_4 @ 0x5581] frame:0    pts:0       pts_time:0
+[Parsed_metadata_4 @ 0x5581] lavfi.scene_score=0.000000
+[Parsed_metadata_4 @ 0x5581] frame:1    pts:1       pts_time:0.2
+[Parsed_metadata_4 @ 0x5581] lavfi.scene_score=0.450000
+[Parsed_metadata_4 @ 0x5581] frame:2    pts:2       pts_time:0.4
+[Parsed_metadata_4 @ 0x5581] lavfi.scene_score=0.100000
+[silencedetect @ 0x5582] silence_start: -0.01
+[silencedetect @ 0x5582] silence_end: 1.5 | silence_duration: 1.51
+[silencedetect @ 0x5582] silence_start: 9.75
+"""
+
+
+@pytest.mark.parametrize("output, expected", [
+    ("", {"scenes": [], "silences": []}),
+    # Оценка до первого pts_time не к чему привязать; ниже порога - отбрасывается;
+    # отрицательное начало тишины - 0; тишина без конца длится до конца файла
+    (ANALYSIS_OUTPUT, {"scenes": [[0.2, 0.45], [0.4, 0.1]], "silences": [[0.0, 1.5], [9.75, None]]}),
+    ("silence_end: 3.0 | silence_duration: 3.0\n", {"scenes": [], "silences": [[0.0, 3.0]]}),
+])
+def test_parse_analysis_output(output, expected):
+    assert segment_planner.parse_analysis_output(output) == expected
+
+
+NO_ANALYSIS = {"scenes": [], "silences": []}
+
+
+@pytest.mark.parametrize("duration, analysis, keyframes, expected", [
+    # Без анализа - ровно через segment_duration
+    (30, NO_ANALYSIS, None, [(0.0, 10.0, False), (10.0, 10.0, False), (20.0, 10.0, False)]),
+    # Короткое видео - один отрезок, даже длиннее segment_duration
+    (12, NO_ANALYSIS, None, [(0.0, 12.0, False)]),
+    # Остаток меньше секунды отбрасывается
+    (30.5, NO_ANALYSIS, None, [(0.0, 10.0, False), (10.0, 10.0, False), (20.0, 10.5, False)]),
+    # Смена сцены в окне MIN..MAX выигрывает у ровной нарезки
+    (40, {"scenes": [[12.0, 0.9]], "silences": []}, None,
+     [(0.0, 12.0, False), (12.0, 10.0, False), (22.0, 10.0, False), (32.0, 8.0, False)]),
+    # Сильная смена сцены за пределами окна не оставляет хвост короче MIN_SEGMENT_DURATION
+    (19, {"scenes": [[15.0, 1.0]], "silences": []}, None, [(0.0, 10.0, False), (10.0, 9.0, False)]),
+    # Смена сцены дальше MAX_SEGMENT_DURATION не выбирается
+    (40, {"scenes": [[16.0, 1.0]], "silences": []}, None,
+     [(0.0, 10.0, False), (10.0, 6.0, False), (16.0, 10.0, False), (26.0, 14.0, False)]),
+    # Тишина до конца файла (конец None) считается тишиной до duration
+    (37.5, {"scenes": [], "silences": [[31.0, None]]}, None,
+     [(0.0, 10.0, False), (10.0, 10.0, False), (20.0, 11.0, False), (31.0, 6.5, False)]),
+    # Смена сцены сдвигается на ключевой кадр рядом (в пределах KEYFRAME_SNAP)
+    (25, {"scenes": [[12.2, 0.9]], "silences": []}, [0.0, 6.0, 12.3, 20.0],
+     [(0.0, 12.3, True), (12.3, 12.7, True)]),
+    # Без смены сцен ключевой кадр в окне лучше точной границы
+    (20, NO_ANALYSIS, [0.0, 9.0], [(0.0, 9.0, True), (9.0, 11.0, True)]),
+])
+def test_segment_planner_plan_segments(duration, analysis, keyframes, expected):
+    pieces = segment_planner.plan_segments(duration, 10, analysis, keyframes)
+    assert rounded(pieces) == expected
+
+
+@pytest.mark.parametrize("duration", [30, 61.3, 600, 1800])
+def test_segment_planner_bounds(duration):
+    analysis = {
+        "scenes": [[t * 0.7, 0.5 + (t % 5) / 10] for t in range(int(duration / 0.7))],
+        "silences": [[t, t + 0.8] for t in range(3, int(duration) - 1, 17)] + [[duration - 0.5, None]],
+    }
+    keyframes = [t * 2.0 for t in range(int(duration / 2) + 1)]
+    pieces = segment_planner.plan_segments(duration, 10, analysis, keyframes)
+
+    assert pieces[0][0] == 0.0
+    for (start, length, _), (next_start, _, _) in zip(pieces, pieces[1:]):
+        assert next_start == pytest.approx(start + length)
+    for _, length, _ in pieces[:-1]:
+        assert 5 <= length <= 15
+    assert pieces[-1][0] + pieces[-1][1] == pytest.approx(duration)
+    assert pieces[-1][1] >= 5 or len(pieces) == 1
+
+
+@pytest.mark.parametrize("duration, keyframes, expected", [
+    (30, None, [(0.0, 10.0, False), (10.0, 10.0, False), (20.0, 10.0, False)]),
+    (25.5, None, [(0.0, 10.0, False), (10.0, 10.0, False), (20.0, 5.5, False)]),
+    (30.5, None, [(0.0, 10.0, False), (10.0, 10.0, False), (20.0, 10.0, False)]),
+    # Граница сдвигается на ближайший к цели ключевой кадр в пределах MIN..MAX
+    (40, [0.0, 9.5, 10.5, 21.0, 30.2],
+     [(0.0, 9.5, True), (9.5, 11.5, True), (21.0, 9.2, True), (30.2, 9.8, True)]),
+    # Ключевых кадров в окне нет - режем ровно, такие отрезки не копируются
+    (30, [0.0, 29.0], [(0.0, 10.0, True), (10.0, 10.0, False), (20.0, 10.0, False)]),
+    # Порядок ключевых кадров не важен
+    (20, [12.0, 0.0, 7.0], [(0.0, 12.0, True), (12.0, 8.0, True)]),
+    # Остаток до MAX_SEGMENT_DURATION - один отрезок, хвост после ключевого кадра не теряется
+    (21.5, [0.0, 10.0, 20.8], [(0.0, 10.0, True), (10.0, 11.5, True)]),
+    # Ключевой кадр ближе MIN_SEGMENT_DURATION к концу не выбирается
+    (25.5, [0.0, 10.0, 24.8], [(0.0, 10.0, True), (10.0, 10.0, True), (20.0, 5.5, False)]),
+])
+def test_video_processor_plan_segments(duration, keyframes, expected):
+    assert rounded(video_processor.plan_segments(duration, 10, keyframes)) == expected
@@ -1,20 +1,31 @@
 """Модуль для обработки видео: скачивание, нарезка, конвертация в кружочки"""
 
 import os
-import subprocess
 import asyncio
+import hashlib
+import json
 import logging
 import re
-import yt_dlp
+import shutil
+import uuid
+from bisect import bisect_left, bisect_right
+from contextlib import nullcontext
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional, Tuple
 import config
+import downloader
+import encoding_profiles
+import quotas
+import segment_buffers
+import segment_planner
 
 logger = logging.getLogger(__name__)
 
-# Создаём папку для временных файлов
+# Папка для временных файлов (создаётся при первом использовании)
 TEMP_DIR = Path(config.TEMP_VIDEOS_DIR)
-TEMP_DIR.mkdir(exist_ok=True)
+
+# Профили H.264, которые можно копировать в кружочки без перекодирования
+H264_COPY_PROFILES = ("Constrained Baseline", "Baseline", "Main", "High")
 
 
 def get_video_filter(size: int, mode: str = "crop") -> str:
@@ -56,65 +67,208 @@ def get_ffmpeg_command(command: str) -> str:
         return command
 
 
+def _record_cpu_time(stderr: Optional[bytes]) -> float:
+    """
+    Добавляет CPU-время процесса ffmpeg в запись текущего задания.
+    
+    Время берётся из вывода ffmpeg с флагом -benchmark
+    ("bench: utime=1.234s stime=0.056s rtime=...").
+    
+    Returns:
+        CPU-время процесса в секундах (0, если его не удалось определить)
+    """
+    match = re.search(rb'bench: utime=([\d.]+)s stime=([\d.]+)s', stderr or b'')
+    if not match:
+        return 0.0
+    cpu_seconds = float(match.group(1)) + float(match.group(2))
+    job = encoding_profiles.current_job()
+    if job is not None:
+        job["cpu_seconds"] = job.get("cpu_seconds", 0.0) + cpu_seconds
+    return cpu_seconds
+
+
+def _binary_fingerprint(command: str) -> Optional[Dict]:
+    """
+    Находит исполняемый файл и возвращает его путь и время изменения.
+    
+    Returns:
+        {"path": ..., "mtime": ...} или None, если файл не найден
+    """
+    path = shutil.which(command)
+    if not path:
+        return None
+    try:
+        return {"path": os.path.realpath(path), "mtime": os.path.getmtime(path)}
+    except OSError:
+        return None
+
+
+async def _run_probe(cmd: List[str], timeout: float = 10) -> Optional[str]:
+    """Запускает команду и возвращает stdout, либо None при ошибке."""
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+    except OSError:
+        return None
+    try:
+        stdout, _ = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        # Не оставляем зависший ffprobe/ffmpeg работать в фоне
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+        await process.wait()
+        return None
+    if process.returncode != 0:
+        return None
+    return stdout.decode('utf-8', errors='ignore')
+
+
+def _parse_codec_list(output: Optional[str]) -> List[str]:
+    """Имена из вывода `ffmpeg -encoders` (строки вида ' V....D libx264  описание')."""
+    if not output:
+        return []
+    # Легенда флагов отделена от списка строкой из дефисов
+    output = output.split('------', 1)[-1]
+    return re.findall(r'^\s*[VAS][A-Z.]{5}\s+(\S+)', output, re.MULTILINE)
+
+
+def _parse_filter_list(output: Optional[str]) -> List[str]:
+    """Имена из вывода `ffmpeg -filters` (строки вида ' TSC scale  V->V  описание')."""
+    if not output:
+        return []
+    output = output.split('------', 1)[-1]
+    return re.findall(r'^\s*[TSC.]{2,3}\s+(\S+)\s+\S*->\S*', output, re.MULTILINE)
+
+
+async def probe_ffmpeg_capabilities(refresh: bool = False) -> Dict:
+    """
+    Определяет возможности FFmpeg/ffprobe: версии, доступные энкодеры и фильтры.
+    
+    Все проверки запускаются параллельно. Результат кешируется на диске
+    (config.CACHE_DIR) с ключом по путям и времени изменения бинарников,
+    поэтому при обычном запуске достаточно одного stat.
+    
+    Args:
+        refresh: Игнорировать кеш и проверить заново
+        
+    Returns:
+        Словарь: available, ffmpeg, ffprobe, ffmpeg_version, encoders, filters
+    """
+    ffmpeg_cmd = get_ffmpeg_command('ffmpeg')
+    ffprobe_cmd = get_ffmpeg_command('ffprobe')
+    fingerprint = {
+        "ffmpeg": _binary_fingerprint(ffmpeg_cmd),
+        "ffprobe": _binary_fingerprint(ffprobe_cmd),
+    }
+    
+    if fingerprint["ffmpeg"] is None:
+        return {"available": False, "ffmpeg": None, "ffprobe": None,
+                "ffmpeg_version": None, "encoders": [], "filters": []}
+    
+    cache_path = Path(config.CACHE_DIR) / "ffmpeg_capabilities.json"
+    if not refresh:
+        try:
+            with open(cache_path, encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get("fingerprint") == fingerprint:
+                return cached["capabilities"]
+        except (OSError, ValueError, KeyError):
+            pass
+    
+    ffmpeg_path = fingerprint["ffmpeg"]["path"]
+    version, encoders, filters, probe_version = await asyncio.gather(
+        _run_probe([ffmpeg_path, '-version']),
+        _run_probe([ffmpeg_path, '-hide_banner', '-encoders']),
+        _run_probe([ffmpeg_path, '-hide_banner', '-filters']),
+        _run_probe([fingerprint["ffprobe"]["path"], '-version']) if fingerprint["ffprobe"] else asyncio.sleep(0),
+    )
+    
+    capabilities = {
+        "available": version is not None,
+        "ffmpeg": ffmpeg_path,
+        "ffprobe": fingerprint["ffprobe"]["path"] if probe_version else None,
+        "ffmpeg_version": version.splitlines()[0] if version else None,
+        "encoders": _parse_codec_list(encoders),
+        "filters": _parse_filter_list(filters),
+    }
+    
+    if capabilities["available"]:
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(cache_path, 'w', encoding='utf-8') as f:
+                json.dump({"fingerprint": fingerprint, "capabilities": capabilities}, f, indent=2)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить кеш возможностей FFmpeg: {e}")
+    
+    return capabilities
+
+
 def check_ffmpeg_available() -> bool:
     """
     Проверяет доступность FFmpeg и (опционально) ffprobe в системе.
 
     Возвращает True, если FFmpeg доступен. Отсутствие ffprobe не считается
     критической ошибкой, так как длительность мы умеем получать и через ffmpeg.
+    Вызывается из синхронного кода; внутри async-кода используйте
+    probe_ffmpeg_capabilities().
     """
-    # Проверяем ffmpeg
+    # Отдельный цикл без set_event_loop: asyncio.run() оставил бы главный поток
+    # без текущего цикла, а run_polling() в PTB 20.8-21.x вызывает get_event_loop()
+    loop = asyncio.new_event_loop()
     try:
-        ffmpeg_cmd = get_ffmpeg_command("ffmpeg")
-        result = subprocess.run(
-            [ffmpeg_cmd, "-version"],
-            capture_output=True,
-            timeout=5,
-        )
-        if result.returncode != 0:
-            logger.error("FFmpeg найден, но возвращает ошибку")
-            return False
-    except FileNotFoundError:
+        capabilities = loop.run_until_complete(probe_ffmpeg_capabilities())
+    finally:
+        loop.close()
+    
+    if not capabilities["available"]:
         logger.error(
             "FFmpeg не найден. Проверьте установку и PATH, "
             "или укажите путь FFMPEG_PATH в config.py"
         )
         return False
-    except subprocess.TimeoutExpired:
-        logger.error("Таймаут при проверке FFmpeg")
-        return False
-    except Exception as e:
-        logger.error(f"Ошибка при проверке FFmpeg: {e}")
-        return False
-
-    # Пробуем проверить ffprobe, но отсутствие не считаем фатальной ошибкой
-    try:
-        ffprobe_cmd = get_ffmpeg_command("ffprobe")
-        result = subprocess.run(
-            [ffprobe_cmd, "-version"],
-            capture_output=True,
-            timeout=5,
+    
+    if config.FFMPEG_VIDEO_CODEC not in capabilities["encoders"]:
+        logger.warning(f"Энкодер {config.FFMPEG_VIDEO_CODEC} не найден в сборке FFmpeg")
+    
+    if capabilities["ffprobe"]:
+        logger.info(
+            f"FFmpeg и ffprobe доступны (ffmpeg: {capabilities['ffmpeg']}, ffprobe: {capabilities['ffprobe']})"
         )
-        if result.returncode != 0:
-            logger.warning("ffprobe найден, но возвращает ошибку, будет использован ffmpeg")
-        else:
-            logger.info(
-                f"FFmpeg и ffprobe доступны (ffmpeg: {ffmpeg_cmd}, ffprobe: {ffprobe_cmd})"
-            )
-    except FileNotFoundError:
+    else:
         logger.debug("ffprobe не найден, для длительности будет использован ffmpeg")
-    except Exception as e:
-        logger.warning(f"Ошибка при проверке ffprobe: {e}")
-
+    
     return True
 
 
-async def download_video(url: str) -> str:
+async def extract_video_info(url: str) -> Dict:
+    """
+    Получает метаданные видео по ссылке через yt-dlp, ничего не скачивая.
+    
+    Нужна, чтобы проверить ограничения (длительность, размер) до скачивания.
+    Метаданные кешируются в downloader, поэтому download_video той же
+    ссылки не запрашивает их повторно.
+    
+    Args:
+        url: Ссылка на видео
+        
+    Returns:
+        Словарь: id, title, duration, filesize (None, если неизвестны), format_id, formats
+    """
+    return await downloader.extract_info(url)
+
+
+async def download_video(url: str, output_dir: Optional[str] = None) -> str:
     """
-    Асинхронно скачивает видео по ссылке через yt-dlp.
+    Асинхронно скачивает видео по ссылке через yt-dlp (в пуле потоков downloader).
     
     Args:
         url: Ссылка на видео (YouTube, TikTok, Instagram и т.д.)
+        output_dir: Папка для скачанного файла (по умолчанию TEMP_DIR)
         
     Returns:
         Путь к скачанному видеофайлу
@@ -122,31 +276,15 @@ async def download_video(url: str) -> str:
     Raises:
         Exception: Если не удалось скачать видео
     """
-    output_path = TEMP_DIR / "source_video.%(ext)s"
+    target_dir = Path(output_dir) if output_dir else TEMP_DIR
+    target_dir.mkdir(parents=True, exist_ok=True)
     
-    ydl_opts = {
-        'format': 'best[ext=mp4]/best',
-        'outtmpl': str(output_path),
-        'quiet': True,
-        'no_warnings': True,
-    }
+    video_path = await downloader.download(url, target_dir)
     
-    # yt-dlp не поддерживает async напрямую, запускаем в executor
-    loop = asyncio.get_event_loop()
-    
-    def download():
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
-    
-    await loop.run_in_executor(None, download)
-    
-    # Находим скачанный файл
-    for ext in ['mp4', 'webm', 'mkv', 'm4a']:
-        video_path = TEMP_DIR / f"source_video.{ext}"
-        if video_path.exists():
-            return str(video_path)
-    
-    raise Exception("Не удалось найти скачанный файл")
+    job = encoding_profiles.current_job()
+    if job is not None:
+        job["download_bytes"] = job.get("download_bytes", 0) + os.path.getsize(video_path)
+    return video_path
 
 
 async def get_video_duration(video_path: str) -> float:
@@ -170,8 +308,6 @@ async def get_video_duration(video_path: str) -> float:
         video_path
     ]
     
-    loop = asyncio.get_event_loop()
-    
     try:
         process = await asyncio.create_subprocess_exec(
             *cmd,
@@ -224,13 +360,183 @@ async def get_video_duration(video_path: str) -> float:
         raise Exception(f"Ошибка при получении длительности видео: {e}")
 
 
-async def optimize_video_size(video_path: str, max_size: int = config.MAX_FILE_SIZE) -> str:
+def _source_cache_path(video_path: str) -> Optional[Path]:
+    """
+    Путь к записи кеша метаданных исходника.
+    
+    Ключ строится по размеру и первым/последним 64 КБ файла, а не по пути:
+    временные файлы часто переиспользуют одно имя для разных видео.
+    """
+    try:
+        size = os.path.getsize(video_path)
+        with open(video_path, 'rb') as f:
+            head = f.read(65536)
+            f.seek(max(0, size - 65536))
+            tail = f.read(65536)
+    except OSError:
+        return None
+    digest = hashlib.sha1(str(size).encode() + head + tail).hexdigest()
+    return Path(config.CACHE_DIR) / "sources" / f"{digest}.json"
+
+
+def load_source_metadata(video_path: str) -> Dict:
+    """Закешированные метаданные исходника (info, keyframes, analysis) или пустой словарь."""
+    cache_path = _source_cache_path(video_path)
+    if cache_path is None:
+        return {}
+    try:
+        with open(cache_path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def update_source_metadata(video_path: str, **fields) -> None:
+    """Дописывает поля в кеш метаданных исходника; старые записи вытесняются."""
+    cache_path = _source_cache_path(video_path)
+    if cache_path is None:
+        return
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        metadata = load_source_metadata(video_path)
+        metadata.update(fields)
+        tmp_path = cache_path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(metadata, f)
+        os.replace(tmp_path, cache_path)
+        
+        entries = list(cache_path.parent.glob('*.json'))
+        if len(entries) > config.SOURCE_CACHE_MAX_ENTRIES:
+            entries.sort(key=lambda p: p.stat().st_mtime)
+            for old in entries[:len(entries) - config.SOURCE_CACHE_MAX_ENTRIES]:
+                old.unlink(missing_ok=True)
+    except OSError as e:
+        logger.warning(f"Не удалось сохранить кеш метаданных {video_path}: {e}")
+
+
+async def probe_video_info(video_path: str) -> Dict:
+    """
+    Получает параметры видео: длительность, размеры, кодеки, частоту кадров и битрейт.
+    
+    Использует ffprobe, а если его нет - разбирает вывод `ffmpeg -i`.
+    Неизвестные значения возвращаются как None. Результат кешируется вместе
+    с остальными метаданными исходника.
+    
+    Args:
+        video_path: Путь к видеофайлу
+        
+    Returns:
+        Словарь: duration, width, height, video_codec, video_profile, pix_fmt,
+        audio_codec, fps, bit_rate, format_name
+    """
+    cached = load_source_metadata(video_path).get("info")
+    # Записи старого формата (без pix_fmt) переснимаем
+    if cached and "pix_fmt" in cached:
+        return cached
+    
+    info = await _probe_video_info(video_path)
+    if info["duration"]:
+        update_source_metadata(video_path, info=info)
+    return info
+
+
+async def _probe_video_info(video_path: str) -> Dict:
+    """Получает параметры видео без кеша (см. probe_video_info)."""
+    info = {
+        "duration": None, "width": None, "height": None, "video_codec": None,
+        "video_profile": None, "pix_fmt": None, "audio_codec": None, "fps": None, "bit_rate": None, "format_name": None,
+    }
+    
+    output = await _run_probe([
+        get_ffmpeg_command('ffprobe'), '-v', 'error',
+        '-show_entries',
+        'format=duration,bit_rate,format_name:'
+        'stream=codec_type,codec_name,profile,pix_fmt,width,height,avg_frame_rate',
+        '-of', 'json', video_path
+    ])
+    if output:
+        try:
+            data = json.loads(output)
+        except ValueError:
+            data = {}
+        fmt = data.get("format", {})
+        info["duration"] = float(fmt["duration"]) if fmt.get("duration") else None
+        info["bit_rate"] = int(fmt["bit_rate"]) if fmt.get("bit_rate") else None
+        info["format_name"] = fmt.get("format_name")
+        for stream in data.get("streams", []):
+            if stream.get("codec_type") == "video" and info["video_codec"] is None:
+                info["video_codec"] = stream.get("codec_name")
+                info["video_profile"] = stream.get("profile")
+                info["pix_fmt"] = stream.get("pix_fmt")
+                info["width"] = stream.get("width")
+                info["height"] = stream.get("height")
+                num, _, den = (stream.get("avg_frame_rate") or "").partition('/')
+                if num and den and float(den):
+                    info["fps"] = float(num) / float(den)
+            elif stream.get("codec_type") == "audio" and info["audio_codec"] is None:
+                info["audio_codec"] = stream.get("codec_name")
+        return info
+    
+    # ffprobe недоступен: `ffmpeg -i` без выходного файла печатает параметры в stderr
+    try:
+        process = await asyncio.create_subprocess_exec(
+            get_ffmpeg_command('ffmpeg'), '-hide_banner', '-i', video_path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        _, stderr = await process.communicate()
+    except FileNotFoundError:
+        return info
+    text = stderr.decode('utf-8', errors='ignore')
+    
+    duration_match = re.search(r'Duration:\s*(\d+):(\d+):(\d+\.?\d*)', text)
+    if duration_match:
+        info["duration"] = (int(duration_match.group(1)) * 3600 + int(duration_match.group(2)) * 60
+                            + float(duration_match.group(3)))
+    bitrate_match = re.search(r'bitrate:\s*(\d+) kb/s', text)
+    if bitrate_match:
+        info["bit_rate"] = int(bitrate_match.group(1)) * 1000
+    input_match = re.search(r'Input #0, ([^,]+(?:,[^,\s]+)*), from', text)
+    if input_match:
+        info["format_name"] = input_match.group(1)
+    video_match = re.search(r'Stream #\S+.*?: Video: (\w+).*?, (\d{2,5})x(\d{2,5})', text)
+    if video_match:
+        info["video_codec"] = video_match.group(1)
+        info["width"] = int(video_match.group(2))
+        info["height"] = int(video_match.group(3))
+    # Например: "Video: h264 (High) (avc1 / 0x31637661), yuv420p(tv, bt709), 640x640"
+    profile_match = re.search(r'Stream #\S+.*?: Video: \w+ \(([^)]+)\)', text)
+    if profile_match:
+        info["video_profile"] = profile_match.group(1)
+    pix_fmt_match = re.search(r'Stream #\S+.*?: Video: \w+[^,\n]*, ([a-z0-9_]+)', text)
+    if pix_fmt_match:
+        info["pix_fmt"] = pix_fmt_match.group(1)
+    fps_match = re.search(r'Video:.*?, ([\d.]+) fps', text)
+    if fps_match:
+        info["fps"] = float(fps_match.group(1))
+    audio_match = re.search(r'Stream #\S+.*?: Audio: (\w+)', text)
+    if audio_match:
+        info["audio_codec"] = audio_match.group(1)
+    return info
+
+
+def _remove_file(path) -> None:
+    """Удаляет файл, если он есть; ошибки удаления не мешают обработке."""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+async def optimize_video_size(video_path: str, max_size: int = config.MAX_FILE_SIZE,
+                              profile: Optional[Dict] = None) -> str:
     """
     Оптимизирует размер видеофайла, если он превышает лимит.
     
     Args:
         video_path: Путь к видеофайлу
         max_size: Максимальный размер в байтах
+        profile: Профиль кодирования (см. encoding_profiles); по умолчанию статические настройки
         
     Returns:
         Путь к оптимизированному файлу (может быть тот же, если оптимизация не нужна)
@@ -241,61 +547,318 @@ async def optimize_video_size(video_path: str, max_size: int = config.MAX_FILE_S
         return video_path
     
     # Пробуем уменьшить разрешение
-    optimized_path = video_path.replace('.mp4', '_optimized.mp4')
-    size = config.VIDEO_SIZE
+    profile = profile or encoding_profiles.static_profile()
+    size = min(config.VIDEO_SIZE, profile["size"])
+    best_path = video_path
     
-    # Уменьшаем разрешение пока файл слишком большой
+    # Уменьшаем разрешение пока файл слишком большой; каждый проход кодирует
+    # исходный файл в новый, предыдущий результат сразу удаляется
     while file_size > max_size and size >= 256:
+        optimized_path = video_path.replace('.mp4', f'_optimized{size}.mp4')
         ffmpeg_cmd = get_ffmpeg_command('ffmpeg')
         cmd = [
             ffmpeg_cmd, '-i', video_path,
             '-vf', get_video_filter(size, config.VIDEO_CROP_MODE),
             '-c:v', config.FFMPEG_VIDEO_CODEC,
-            '-preset', config.FFMPEG_PRESET,
-            '-crf', '28',  # Увеличиваем CRF для меньшего размера
+            '-preset', profile["preset"],
+            '-crf', str(max(28, profile["crf"])),  # Увеличиваем CRF для меньшего размера
             '-c:a', config.FFMPEG_AUDIO_CODEC,
             '-b:a', '96k',  # Уменьшаем битрейт аудио
             '-movflags', '+faststart',
+            '-benchmark',  # Для учёта CPU-времени (см. _record_cpu_time)
             '-y',
             optimized_path
         ]
         
-        loop = asyncio.get_event_loop()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            _, stderr = await process.communicate()
+        except asyncio.CancelledError:
+            _remove_file(optimized_path)
+            if best_path != video_path:
+                _remove_file(best_path)
+            raise
+        _record_cpu_time(stderr)
+        
+        if process.returncode == 0 and os.path.exists(optimized_path):
+            if best_path != video_path:
+                _remove_file(best_path)
+            best_path = optimized_path
+            file_size = os.path.getsize(optimized_path)
+            # Если всё ещё слишком большой, пробуем ещё меньшее разрешение
+            size -= 64
+        else:
+            # Недописанный файл (например, закончилось место) не оставляем
+            _remove_file(optimized_path)
+            break
+    
+    # Возвращаем лучшее, что получилось; оригинал больше не нужен
+    if best_path != video_path:
+        _remove_file(video_path)
+    return best_path
+
+
+def is_circle_compatible(info: Dict) -> bool:
+    """
+    Проверяет, можно ли нарезать исходник без перекодирования.
+    
+    Подходит квадратное 8-битное H.264 4:2:0 (+AAC или без звука) в MP4/MOV,
+    не больше VIDEO_SIZE - например, пересланный кружочек. 10-битное и 4:4:4
+    H.264 многие клиенты Telegram не воспроизводят, такие исходники перекодируются.
+    """
+    return (
+        info.get("video_codec") == "h264"
+        and info.get("pix_fmt") == "yuv420p"
+        and info.get("video_profile") in H264_COPY_PROFILES
+        and info.get("audio_codec") in ("aac", None)
+        and bool(info.get("width")) and info.get("width") == info.get("height")
+        and info["width"] <= config.VIDEO_SIZE
+        and "mp4" in (info.get("format_name") or "")
+    )
+
+
+async def probe_keyframes(video_path: str) -> List[float]:
+    """
+    Возвращает время ключевых кадров видео (в секундах).
+    
+    Читает только заголовки пакетов (без декодирования), поэтому работает быстро.
+    Без ffprobe возвращает пустой список. Результат кешируется.
+    """
+    cached = load_source_metadata(video_path).get("keyframes")
+    if cached is not None:
+        return cached
+    
+    output = await _run_probe([
+        get_ffmpeg_command('ffprobe'), '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', video_path
+    ], timeout=60)
+    keyframes = []
+    for line in (output or "").splitlines():
+        pts_time, _, flags = line.partition(',')
+        if 'K' in flags:
+            try:
+                keyframes.append(float(pts_time))
+            except ValueError:
+                continue
+    keyframes.sort()
+    if output is not None:
+        update_source_metadata(video_path, keyframes=keyframes)
+    return keyframes
+
+
+async def analyze_segment_boundaries(video_path: str, use_cache: bool = True) -> Dict:
+    """
+    Собирает смены сцен и интервалы тишины одним проходом FFmpeg.
+    
+    Кадры прореживаются и уменьшаются, звук передискретизируется, поэтому проход
+    намного дешевле кодирования. Результат кешируется с метаданными исходника.
+    
+    Args:
+        video_path: Путь к видеофайлу
+        use_cache: Использовать кеш (False - всегда анализировать заново)
+        
+    Returns:
+        {"scenes": [[время, оценка], ...], "silences": [[начало, конец|None], ...]}
+    """
+    if use_cache:
+        cached = load_source_metadata(video_path).get("analysis")
+        if cached is not None:
+            return cached
+    
+    cmd = segment_planner.analysis_command(get_ffmpeg_command('ffmpeg'), video_path)
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    _, stderr = await process.communicate()
+    _record_cpu_time(stderr)
+    
+    if process.returncode != 0:
+        logger.warning(f"Анализ границ отрезков не удался (код {process.returncode}), режем равномерно")
+        return {"scenes": [], "silences": []}
+    
+    analysis = segment_planner.parse_analysis_output(stderr.decode('utf-8', errors='ignore'))
+    update_source_metadata(video_path, analysis=analysis)
+    return analysis
+
+
+def plan_segments(duration: float, segment_duration: int,
+                  keyframes: Optional[List[float]] = None) -> List[Tuple[float, float, bool]]:
+    """
+    Разбивает видео на отрезки.
+    
+    Без ключевых кадров режет через каждые segment_duration секунд. Если ключевые
+    кадры известны, границы сдвигаются на ближайший ключевой кадр в пределах
+    MIN_SEGMENT_DURATION..MAX_SEGMENT_DURATION, чтобы отрезок можно было скопировать.
+    
+    Returns:
+        Список (начало, длительность, начинается_с_ключевого_кадра)
+    """
+    keyframes = sorted(keyframes) if keyframes else []
+    pieces = []
+    start_time = 0.0
+    
+    while start_time < duration:
+        remaining = duration - start_time
+        # Пропускаем слишком короткие отрезки (< 1 секунды)
+        if remaining < 1.0:
+            break
+        
+        end_time = min(start_time + segment_duration, duration)
+        if keyframes and remaining > segment_duration:
+            if remaining <= config.MAX_SEGMENT_DURATION:
+                # Остаток помещается в один отрезок: не оставляем после ключевого кадра хвост
+                end_time = duration
+            else:
+                # Ключевые кадры отсортированы: окно находим бинарным поиском. Кадры ближе
+                # MIN_SEGMENT_DURATION к концу не берём - хвост после них был бы слишком коротким
+                window = keyframes[
+                    bisect_left(keyframes, start_time + config.MIN_SEGMENT_DURATION):
+                    bisect_right(keyframes, min(start_time + config.MAX_SEGMENT_DURATION,
+                                                duration - config.MIN_SEGMENT_DURATION))
+                ]
+                if window:
+                    end_time = min(window, key=lambda k: abs(k - (start_time + segment_duration)))
+        
+        i = bisect_left(keyframes, start_time - 0.001)
+        on_keyframe = bool(keyframes) and (
+            start_time == 0.0 or (i < len(keyframes) and abs(keyframes[i] - start_time) < 0.001)
+        )
+        pieces.append((start_time, end_time - start_time, on_keyframe))
+        start_time = end_time
+    
+    return pieces
+
+
+async def _copy_segment(video_path: str, start_time: float, duration: float, output_path: Path) -> bool:
+    """
+    Вырезает отрезок без перекодирования (stream copy).
+    
+    Returns:
+        True, если отрезок создан и укладывается в MAX_FILE_SIZE
+    """
+    cmd = [
+        get_ffmpeg_command('ffmpeg'),
+        '-ss', str(start_time),
+        '-i', video_path,
+        '-t', str(duration),
+        '-map', '0:v:0', '-map', '0:a:0?',
+        '-c', 'copy',
+        '-avoid_negative_ts', 'make_zero',
+        '-movflags', '+faststart',
+        '-benchmark',
+        '-y',
+        str(output_path)
+    ]
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    _, stderr = await process.communicate()
+    _record_cpu_time(stderr)
+    
+    if process.returncode == 0 and os.path.exists(output_path):
+        if os.path.getsize(output_path) <= config.MAX_FILE_SIZE:
+            return True
+    _remove_file(output_path)
+    return False
+
+
+async def _make_segment(video_path: str, segment_num: int, start_time: float, duration: float,
+                        try_copy: bool, profile: Dict, output_path: Path) -> Optional[Tuple[str, bool]]:
+    """
+    Создаёт один кружочек: копирует отрезок без перекодирования (если try_copy) или кодирует.
+    
+    Returns:
+        (путь к файлу, скопирован ли без перекодирования) или None, если отрезок не удался;
+        недописанные файлы при этом удаляются
+        
+    Raises:
+        Exception: Если FFmpeg не найден
+    """
+    if try_copy:
+        if await _copy_segment(video_path, start_time, duration, output_path):
+            return str(output_path), True
+        logger.info(f"Отрезок {segment_num} не удалось скопировать без перекодирования, перекодируем")
+    
+    # FFmpeg команда для обработки одного отрезка
+    # -ss перед -i: быстрый переход к ближайшему ключевому кадру вместо
+    # декодирования всего видео с начала (точность при перекодировании та же)
+    ffmpeg_cmd = get_ffmpeg_command('ffmpeg')
+    cmd = [
+        ffmpeg_cmd,
+        '-ss', str(start_time),
+        '-i', video_path,
+        '-t', str(duration),
+        '-vf', get_video_filter(profile["size"], config.VIDEO_CROP_MODE),
+        '-c:v', config.FFMPEG_VIDEO_CODEC,
+        '-preset', profile["preset"],
+        '-crf', str(profile["crf"]),
+        '-c:a', config.FFMPEG_AUDIO_CODEC,
+        '-b:a', config.FFMPEG_AUDIO_BITRATE,
+        '-movflags', '+faststart',
+        '-benchmark',  # Для учёта CPU-времени (см. _record_cpu_time)
+        '-y',  # Перезаписать если существует
+        str(output_path)
+    ]
+    
+    try:
         process = await asyncio.create_subprocess_exec(
             *cmd,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE
         )
-        await process.communicate()
+        stdout, stderr = await process.communicate()
+        _record_cpu_time(stderr)
         
-        if process.returncode == 0 and os.path.exists(optimized_path):
-            file_size = os.path.getsize(optimized_path)
-            if file_size <= max_size:
-                # Удаляем оригинал, если он отличается
-                if optimized_path != video_path:
-                    try:
-                        os.remove(video_path)
-                    except:
-                        pass
-                return optimized_path
-            else:
-                # Пробуем ещё меньшее разрешение
-                size -= 64
-                video_path = optimized_path
+        if process.returncode != 0:
+            error_msg = stderr.decode('utf-8', errors='ignore') if stderr else "Неизвестная ошибка"
+            logger.error(f"Ошибка обработки отрезка {segment_num} (код {process.returncode}): {error_msg}")
+            # Продолжаем с другими отрезками, даже если один не удался
+            _remove_file(output_path)
+        elif os.path.exists(output_path):
+            # Оптимизируем размер файла
+            return await optimize_video_size(str(output_path), profile=profile), False
         else:
-            break
-    
-    # Если всё ещё слишком большой, возвращаем что есть
-    return optimized_path if os.path.exists(optimized_path) else video_path
+            logger.warning(f"Файл {output_path} не был создан")
+    except FileNotFoundError as e:
+        logger.error(f"FFmpeg не найден при обработке отрезка {segment_num}: {e}")
+        _remove_file(output_path)
+        raise Exception("FFmpeg не найден. Убедитесь, что FFmpeg установлен и доступен в PATH")
+    except asyncio.CancelledError:
+        _remove_file(output_path)
+        raise
+    except Exception as e:
+        logger.error(f"Неожиданная ошибка при обработке отрезка {segment_num}: {e}")
+        _remove_file(output_path)
+        raise
+    return None
 
 
-async def cut_video_to_circles(video_path: str, segment_duration: int = config.DEFAULT_SEGMENT_DURATION) -> List[str]:
+async def cut_video_to_circles(video_path: str, segment_duration: int = config.DEFAULT_SEGMENT_DURATION,
+                               output_dir: Optional[str] = None, prefix: str = "circle",
+                               profile: Optional[Dict] = None,
+                               smart_boundaries: Optional[bool] = None) -> List[str]:
     """
     Нарезает видео на отрезки и преобразует в квадратный формат для кружочек.
     
+    Профиль кодирования выбирается по текущей нагрузке (если не передан явно)
+    и записывается в запись текущего задания (encoding_profiles.track_job).
+    
     Args:
         video_path: Путь к исходному видео
         segment_duration: Длительность каждого отрезка в секундах
+        output_dir: Папка для готовых отрезков (по умолчанию - в памяти, если позволяет
+            бюджет SEGMENT_MEMORY_BUDGET, иначе TEMP_DIR)
+        prefix: Префикс имён файлов отрезков
+        profile: Профиль кодирования (по умолчанию encoding_profiles.select_profile())
+        smart_boundaries: Резать по сменам сцен и паузам (по умолчанию config.SMART_SEGMENT_BOUNDARIES)
         
     Returns:
         Список путей к обработанным файлам
@@ -307,68 +870,74 @@ async def cut_video_to_circles(video_path: str, segment_duration: int = config.D
     segment_duration = max(config.MIN_SEGMENT_DURATION, 
                           min(config.MAX_SEGMENT_DURATION, segment_duration))
     
-    duration = await get_video_duration(video_path)
+    info = await probe_video_info(video_path)
+    duration = info["duration"] if info["duration"] else await get_video_duration(video_path)
+    
+    # Маленькие исходники кодируем в родном разрешении, без апскейла
+    profile = encoding_profiles.fit_profile_to_source(
+        profile or encoding_profiles.select_profile(), info["width"], info["height"]
+    )
+    job = encoding_profiles.current_job()
+    if job is not None:
+        job["profile"] = profile
+    logger.info(f"Профиль кодирования для {video_path}: {profile}")
+    
     output_files = []
-    size = config.VIDEO_SIZE
+    target_dir = Path(output_dir) if output_dir else TEMP_DIR
+    target_dir.mkdir(parents=True, exist_ok=True)
     
-    start_time = 0.0
-    segment_num = 0
+    # Совместимые исходники (например, пересланные кружочки) режем по ключевым
+    # кадрам без перекодирования; перекодируются только неподходящие отрезки
+    copy_allowed = is_circle_compatible(info)
+    if smart_boundaries is None:
+        smart_boundaries = config.SMART_SEGMENT_BOUNDARIES
+    keyframes = await probe_keyframes(video_path) if copy_allowed or smart_boundaries else None
     
-    while start_time < duration:
-        end_time = min(start_time + segment_duration, duration)
-        actual_duration = end_time - start_time
-        
-        # Пропускаем слишком короткие отрезки (< 1 секунды)
-        if actual_duration < 1.0:
-            break
-        
-        output_path = TEMP_DIR / f"circle_{segment_num}.mp4"
-        
-        # FFmpeg команда для обработки одного отрезка
-        ffmpeg_cmd = get_ffmpeg_command('ffmpeg')
-        cmd = [
-            ffmpeg_cmd, '-i', video_path,
-            '-ss', str(start_time),
-            '-t', str(actual_duration),
-            '-vf', get_video_filter(size, config.VIDEO_CROP_MODE),
-            '-c:v', config.FFMPEG_VIDEO_CODEC,
-            '-preset', config.FFMPEG_PRESET,
-            '-crf', str(config.FFMPEG_CRF),
-            '-c:a', config.FFMPEG_AUDIO_CODEC,
-            '-b:a', config.FFMPEG_AUDIO_BITRATE,
-            '-movflags', '+faststart',
-            '-y',  # Перезаписать если существует
-            str(output_path)
-        ]
-        
-        loop = asyncio.get_event_loop()
-        try:
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await process.communicate()
-            
-            if process.returncode != 0:
-                error_msg = stderr.decode('utf-8', errors='ignore') if stderr else "Неизвестная ошибка"
-                logger.error(f"Ошибка обработки отрезка {segment_num} (код {process.returncode}): {error_msg}")
-                # Продолжаем с другими отрезками, даже если один не удался
-            elif os.path.exists(output_path):
-                # Оптимизируем размер файла
-                optimized_path = await optimize_video_size(str(output_path))
-                output_files.append(optimized_path)
-            else:
-                logger.warning(f"Файл {output_path} не был создан")
-        except FileNotFoundError as e:
-            logger.error(f"FFmpeg не найден при обработке отрезка {segment_num}: {e}")
-            raise Exception("FFmpeg не найден. Убедитесь, что FFmpeg установлен и доступен в PATH")
-        except Exception as e:
-            logger.error(f"Неожиданная ошибка при обработке отрезка {segment_num}: {e}")
-            raise
-        
-        start_time = end_time
-        segment_num += 1
+    if smart_boundaries:
+        analysis = await analyze_segment_boundaries(video_path)
+        # Чистый Python: на длинных исходниках не держим event loop
+        pieces = await asyncio.to_thread(segment_planner.plan_segments, duration, segment_duration,
+                                         analysis, keyframes)
+    else:
+        pieces = plan_segments(duration, segment_duration, keyframes if copy_allowed else None)
+    
+    if job is not None and job.get("reservation") is not None:
+        # Длительность документов и прямых ссылок до скачивания часто неизвестна:
+        # ограничения квот проверяем сейчас, до кодирования
+        quotas.check_planned(job["reservation"], duration, len(pieces))
+    
+    copied = 0
+    use_memory = output_dir is None
+    if use_memory:
+        # Папка в памяти общая для всех заданий и процессов - имена должны быть уникальными
+        prefix = f"{prefix}_{os.getpid()}_{uuid.uuid4().hex[:8]}"
+    try:
+        for segment_num, (start_time, actual_duration, on_keyframe) in enumerate(pieces):
+            # Кружочки для бота живут секунды: по возможности пишем их в память (tmpfs)
+            segment_context = segment_buffers.reserve(target_dir) if use_memory else nullcontext(target_dir)
+            with segment_context as segment_dir:
+                output_path = segment_dir / f"{prefix}_{segment_num}.mp4"
+                result = await _make_segment(video_path, segment_num, start_time, actual_duration,
+                                             copy_allowed and on_keyframe, profile, output_path)
+                if result is None and segment_dir != target_dir:
+                    # В tmpfs могло закончиться место раньше бюджета: повторяем на диске
+                    logger.info(f"Отрезок {segment_num} не удалось записать в {segment_dir}, пробуем на диске")
+                    result = await _make_segment(video_path, segment_num, start_time, actual_duration,
+                                                 copy_allowed and on_keyframe, profile,
+                                                 target_dir / output_path.name)
+            if result is not None:
+                output_files.append(result[0])
+                copied += result[1]
+    except BaseException:
+        # Уже готовые кружочки никто не отправит: удаляем их, чтобы не занимали память и диск
+        for path in output_files:
+            _remove_file(path)
+        raise
+    
+    if job is not None:
+        job["circles"] = len(output_files)
+        job["copied_segments"] = copied
+        job["memory_segments"] = sum(1 for path in output_files if segment_buffers.is_in_memory(path))
     
     if not output_files:
         raise Exception("Не удалось создать ни одного отрезка")
@@ -399,6 +968,9 @@ async def process_video_to_circles(url: str, segment_duration: int = config.DEFA
         circles = await cut_video_to_circles(video_path, segment_duration)
         
         return circles
+    except quotas.QuotaExceeded:
+        # Текст для пользователя, без обёртки
+        raise
     except Exception as e:
         raise Exception(f"Ошибка обработки видео: {str(e)}")
     finally: